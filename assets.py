@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+"""Build the pre-decoded assets that timeline.py plays.
+
+Decodes each event video in timeline.json once with ffmpeg, scaled and
+cropped to the panel, into a frame store next to the source, e.g.
+images/dust_bowl.mov -> images/dust_bowl.frames. run_game plays a frame
+store in place of its video whenever the store is at least as new. Each
+video's first frame is also saved as its poster, images/dust_bowl.poster.png,
+which run_game shows until the video has opened, and its audio as PCM at
+the mixer's rate, images/dust_bowl.wav, which plays along with the frames.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+from fractions import Fraction
+from typing import Iterator, Tuple
+
+from PIL import Image
+
+import framestore
+import posters
+import soundtracks
+
+DEFAULT_SIZE: int = 128
+# Frames beyond the game's frame rate are never shown, so aren't stored.
+DEFAULT_MAX_FPS: int = 30
+
+def probe_fps(filepath: str) -> Fraction:
+    result = subprocess.run(["ffprobe", "-v", "error", "-select_streams", "v:0",
+                             "-show_entries", "stream=avg_frame_rate", "-of", "csv=p=0", filepath],
+                            check=True, capture_output=True, text=True)
+    return Fraction(result.stdout.strip())
+
+def has_audio(filepath: str) -> bool:
+    result = subprocess.run(["ffprobe", "-v", "error", "-select_streams", "a", "-show_entries", "stream=index",
+                             "-of", "csv=p=0", filepath], check=True, capture_output=True, text=True)
+    return bool(result.stdout.strip())
+
+def decode_frames(filepath: str, size: Tuple[int, int], fps: Fraction, start: float = 0.0) -> Iterator[bytes]:
+    """Yield a video's frames from start seconds on as RGB24 bytes.
+
+    Frames are scaled to cover size and cropped to it. Closing the generator
+    early stops ffmpeg.
+    """
+    width, height = size
+    filters = f"fps={fps},scale={width}:{height}:force_original_aspect_ratio=increase,crop={width}:{height}"
+    process = subprocess.Popen(["ffmpeg", "-v", "error", "-ss", str(start), "-i", filepath, "-vf", filters,
+                                "-an", "-f", "rawvideo", "-pix_fmt", "rgb24", "-"], stdout=subprocess.PIPE)
+    frame_bytes = width * height * 3
+    finished = False
+    try:
+        while True:
+            frame = process.stdout.read(frame_bytes)
+            if len(frame) < frame_bytes:
+                break
+            yield frame
+        finished = True
+    finally:
+        if not finished:
+            process.kill()
+        process.stdout.close()
+        returncode = process.wait()
+    if returncode:
+        raise subprocess.CalledProcessError(returncode, process.args)
+
+def build_frame_store(filepath: str, size: Tuple[int, int], max_fps: int) -> int:
+    """Decode filepath into its frame store and return the frame count."""
+    fps = min(probe_fps(filepath), Fraction(max_fps))
+    destination = framestore.store_path(filepath)
+    partial = destination + ".partial"
+    with open(partial, "wb") as file:
+        frames = framestore.write_store(file, size, float(fps), decode_frames(filepath, size, fps))
+    os.replace(partial, destination)
+    return frames
+
+def build_poster(filepath: str, size: Tuple[int, int], max_fps: int) -> None:
+    """Save the first frame of filepath, as a frame store would hold it, as its poster."""
+    frames = decode_frames(filepath, size, min(probe_fps(filepath), Fraction(max_fps)))
+    try:
+        first = next(frames)
+    finally:
+        frames.close()
+    destination = posters.poster_path(filepath)
+    partial = destination + ".partial"
+    Image.frombytes("RGB", size, first).save(partial, format="PNG")
+    os.replace(partial, destination)
+
+def build_soundtrack(filepath: str, rate: int) -> bool:
+    """Decode filepath's audio into its soundtrack; return False if it has none."""
+    if not has_audio(filepath):
+        return False
+    destination = soundtracks.soundtrack_path(filepath)
+    partial = destination + ".partial"
+    subprocess.run(["ffmpeg", "-v", "error", "-y", "-i", filepath, "-vn", "-ac", str(soundtracks.CHANNELS),
+                    "-ar", str(rate), "-c:a", "pcm_s16le", "-f", "wav", partial], check=True)
+    os.replace(partial, destination)
+    return True
+
+def is_current(filepath: str, destination: str) -> bool:
+    return os.path.exists(destination) and os.path.getmtime(destination) >= os.path.getmtime(filepath)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--timeline", default="timeline.json", help="timeline whose videos to build")
+    parser.add_argument("--size", type=int, default=DEFAULT_SIZE, help="width and height of the panel")
+    parser.add_argument("--max-fps", type=int, default=DEFAULT_MAX_FPS, help="highest frame rate to keep")
+    parser.add_argument("--audio-rate", type=int, default=soundtracks.DEFAULT_RATE,
+                        help="sample rate of the soundtracks, the mixer's")
+    parser.add_argument("--force", action="store_true", help="rebuild assets that are up to date")
+    args = parser.parse_args()
+
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    with open(args.timeline) as file:
+        videos = sorted({event["video"] for event in json.load(file) if "video" in event})
+
+    size = (args.size, args.size)
+    failed = False
+    for filepath in videos:
+        if not os.path.exists(filepath):
+            print(f"{filepath}: missing, skipped", file=sys.stderr)
+            failed = True
+            continue
+        store = framestore.store_path(filepath)
+        if is_current(filepath, store) and not args.force:
+            print(f"{filepath}: up to date")
+        else:
+            frames = build_frame_store(filepath, size, args.max_fps)
+            print(f"{filepath}: {frames} frames -> {store}")
+        poster = posters.poster_path(filepath)
+        if args.force or not is_current(filepath, poster):
+            build_poster(filepath, size, args.max_fps)
+            print(f"{filepath}: poster -> {poster}")
+        soundtrack = soundtracks.soundtrack_path(filepath)
+        if args.force or not is_current(filepath, soundtrack):
+            if build_soundtrack(filepath, args.audio_rate):
+                print(f"{filepath}: soundtrack -> {soundtrack}")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
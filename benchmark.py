@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+"""Headless benchmark of the timeline frame loop.
+
+Runs TimelineGame.run_game with SDL's dummy drivers, a stand-in matrix and a
+virtual clock, so frames run back to back instead of at FPS. Scripted input
+visits every event in timeline.json, dwelling on each for a number of frames,
+and the results are printed as JSON. PREVIEW and PREVIEW_FPS apply as in
+timeline.py, so PREVIEW=none measures a kiosk without a window. Videos
+played from frame stores follow the virtual clock too, so they advance at
+their own frame rates relative to the game's.
+
+With --hub75, instead compares the time and memory allocated per frame by
+hub75.update against the original tobytes/frombytes/rotate path, and times
+hub75.update driving a U-mapped wall of 24 panels.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from typing import Callable, Iterator, List, Optional, Tuple
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+from PIL import Image
+import pygame
+
+import framestore
+import hub75
+import metrics
+import panelmap
+import timeline
+import videopool
+
+class VirtualTime:
+    """Millisecond time source that only moves when advanced."""
+
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> int:
+        return int(self.now)
+
+    def advance(self, milliseconds: float) -> None:
+        self.now += milliseconds
+
+class ScriptedInput:
+    """Key source that steps right through every event, then quits.
+
+    run_game polls it once per frame, so it also advances the virtual clock
+    by one frame and records the wall time of each frame.
+    """
+
+    def __init__(self, game: timeline.TimelineGame, virtual_time: VirtualTime, dwell: int) -> None:
+        self.game = game
+        self.virtual_time = virtual_time
+        self.dwell = dwell
+        self.frame = 0
+        self.frame_times: List[float] = []
+        self.visited: set[int] = set()
+        self._last = 0
+
+    def __call__(self) -> Iterator[Tuple[str, bool]]:
+        now = time.perf_counter_ns()
+        if self._last:
+            self.frame_times.append((now - self._last) / 1e6)
+        self._last = now
+        self.virtual_time.advance(1000 / timeline.FPS)
+        self.visited.add(self.game.current_position)
+
+        self.frame += 1
+        if self.frame % self.dwell == 0:
+            if self.game.current_position == len(self.game.events) - 1:
+                yield "quit", True
+            else:
+                yield "right", True
+                yield "right", False
+
+def run(dwell: int) -> dict:
+    virtual_time = VirtualTime()
+    game = timeline.TimelineGame(time_func=virtual_time)
+    script = ScriptedInput(game, virtual_time, dwell)
+    game.key_source = script
+    open_video = game.open_video
+
+    def open_virtual_video(filepath: str) -> Optional[videopool.Playable]:
+        video = open_video(filepath)
+        if isinstance(video, framestore.FramePlayer):
+            video.time_func = lambda: virtual_time.now / 1000
+        return video
+
+    game.video_pool.open_video = open_virtual_video
+
+    start = time.perf_counter()
+    asyncio.run(game.run_game())
+    elapsed = time.perf_counter() - start
+
+    ordered = sorted(script.frame_times)
+    return {
+        "frames": script.frame,
+        "seconds": elapsed,
+        "fps": script.frame / elapsed,
+        "frame_ms": {
+            "p50": metrics.percentile(ordered, 0.50),
+            "p95": metrics.percentile(ordered, 0.95),
+            "p99": metrics.percentile(ordered, 0.99),
+            "max": ordered[-1],
+        },
+        "events_visited": len(script.visited),
+        "events": len(game.events),
+        **metrics.snapshot(),
+    }
+
+def legacy_hub75_update(screen: pygame.Surface) -> None:
+    """The original hub75.update, for comparison."""
+    pixels = pygame.image.tobytes(screen, "RGB")
+    img = Image.frombytes("RGB", (screen.get_width(), screen.get_height()), pixels)
+    img = img.rotate(180, Image.NEAREST, expand=1)
+    hub75.writer.canvas.SetImage(img)
+    hub75.matrix.SwapOnVSync(hub75.writer.canvas)
+
+def time_hub75_path(update: Callable[[pygame.Surface], None], frames: int, full: bool) -> dict:
+    screen = pygame.Surface((timeline.SCREEN_WIDTH, timeline.SCREEN_HEIGHT), pygame.SRCALPHA)
+    rng = random.Random(0)
+    elapsed = 0
+    peak = 0
+    tracemalloc.start()
+    for frame in range(frames):
+        if full:
+            screen.fill((rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+        pygame.draw.circle(screen, (frame % 256, 0, 0), (frame % timeline.SCREEN_WIDTH, 1), 1)
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter_ns()
+        update(screen)
+        elapsed += time.perf_counter_ns() - start
+        if frame > 1:
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - before)
+    tracemalloc.stop()
+    return {"ms_per_frame": elapsed / frames / 1e6, "peak_bytes_allocated_per_frame": peak}
+
+def run_hub75(frames: int) -> dict:
+    """Time hub75.update against the original path on a stand-in matrix."""
+    layout = panelmap.PanelLayout(rows=32, cols=64, chain=2, rotate=180)
+    hub75.init(hub75.NullMatrix(*layout.matrix_size), threaded=False, panel_layout=layout)
+    results = {}
+    for name, full in (("dot_moves", False), ("full_frame_changes", True)):
+        results[name] = {
+            "legacy": time_hub75_path(legacy_hub75_update, frames, full),
+            "hub75": time_hub75_path(hub75.update, frames, full),
+        }
+
+    # --led-pixel-mapper=U-mapper --led-chain 8 --led-parallel=3
+    layout = panelmap.PanelLayout(rows=32, cols=64, chain=8, parallel=3, mapper="U-mapper")
+    hub75.init(hub75.NullMatrix(*layout.matrix_size), threaded=False, panel_layout=layout)
+    results["u_mapper_wall"] = {
+        "hub75": time_hub75_path(hub75.update, frames, True),
+    }
+    return results
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dwell", type=int, default=60, help="frames to stay on each event")
+    parser.add_argument("--output", help="also write the JSON results to this file")
+    parser.add_argument("--hub75", action="store_true", help="microbenchmark hub75.update instead")
+    parser.add_argument("--frames", type=int, default=1000, help="frames to push with --hub75")
+    args = parser.parse_args()
+
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    pygame.init()
+    if args.hub75:
+        results = run_hub75(args.frames)
+    else:
+        hub75.init(hub75.NullMatrix(*hub75.layout.matrix_size))
+        results = run(args.dwell)
+        hub75.shutdown()
+    pygame.quit()
+
+    report = json.dumps(results, indent=2)
+    print(report)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(report)
+    sys.exit(0 if args.hub75 or results["events_visited"] == results["events"] else 1)
+
+if __name__ == "__main__":
+    main()
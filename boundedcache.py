@@ -0,0 +1,67 @@
+from collections import OrderedDict
+from typing import Callable, Generic, Hashable, Optional, TypeVar
+
+import pygame
+
+V = TypeVar("V")
+
+def surface_bytes(surface: pygame.Surface) -> int:
+    return surface.get_pitch() * surface.get_height()
+
+class BoundedCache(Generic[V]):
+    """LRU cache bounded by number of entries, total bytes, or both.
+
+    The bytes of each value are given by sizeof, such as surface_bytes for
+    surfaces. A value bigger than max_bytes on its own is not kept. Hits,
+    misses and evictions are counted for stats.
+    """
+
+    def __init__(self, max_entries: Optional[int] = None, max_bytes: Optional[int] = None,
+                 sizeof: Callable[[V], int] = lambda value: 0) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict[Hashable, V] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[V]:
+        """Return the value cached for key, or None, counting a hit or a miss."""
+        value = self._entries.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: V) -> V:
+        """Cache value for key, evicting the least recently used beyond the bounds."""
+        size = self.sizeof(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return value
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self.bytes -= self.sizeof(previous)
+        self._entries[key] = value
+        self.bytes += size
+        while ((self.max_entries is not None and len(self._entries) > self.max_entries)
+               or (self.max_bytes is not None and self.bytes > self.max_bytes)):
+            _, evicted = self._entries.popitem(last=False)
+            self.bytes -= self.sizeof(evicted)
+            self.evictions += 1
+        return value
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.bytes = 0
+
+    def stats(self) -> dict[str, Optional[int]]:
+        return {"entries": len(self._entries), "max_entries": self.max_entries,
+            "bytes": self.bytes, "max_bytes": self.max_bytes,
+            "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
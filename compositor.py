@@ -0,0 +1,134 @@
+from typing import Callable, Hashable, List, Optional, Tuple
+
+import pygame
+from pygame import Color
+
+import metrics
+
+class Layer:
+    """A retained surface holding one part of the frame.
+
+    `state` returns a hashable snapshot of everything the layer's pixels
+    depend on and `rect` returns the area it draws into. The layer re-renders
+    into its own surface, and bumps its version, only when either changes.
+    """
+
+    def __init__(self, name: str, size: Tuple[int, int], draw: Callable[[pygame.Surface], None],
+                 state: Callable[[], Hashable], rect: Callable[[], pygame.Rect]) -> None:
+        self.name = name
+        self.surface = pygame.Surface(size, pygame.SRCALPHA)
+        self.draw = draw
+        self.state = state
+        self.rect = rect
+        self.version = 0
+        self.last_state: Hashable = None
+        self.last_rect: Optional[pygame.Rect] = None
+
+    def update(self) -> List[pygame.Rect]:
+        """Re-render if the inputs changed and return the rects that changed."""
+        state, rect = self.state(), self.rect()
+        if self.last_rect is not None and state == self.last_state and rect == self.last_rect:
+            return []
+
+        dirty = [rect] if self.last_rect is None else [self.last_rect, rect]
+        if self.last_rect is not None:
+            self.surface.fill((0, 0, 0, 0), self.last_rect)
+        self.surface.set_clip(rect)
+        with metrics.frame_timer.stage(self.name):
+            self.draw(self.surface)
+        self.surface.set_clip(None)
+        self.version += 1
+        self.last_state, self.last_rect = state, rect
+        return dirty
+
+def merge_rects(rects: List[pygame.Rect]) -> List[pygame.Rect]:
+    """Union overlapping rects until the remaining ones are disjoint."""
+    merged: List[pygame.Rect] = []
+    for rect in rects:
+        rect = rect.copy()
+        overlapping = rect.collidelist(merged)
+        while overlapping != -1:
+            rect.union_ip(merged.pop(overlapping))
+            overlapping = rect.collidelist(merged)
+        merged.append(rect)
+    return merged
+
+class Compositor:
+    """A stack of retained layers composited onto one surface.
+
+    Layers are stacked in the order they were added. Each frame only the
+    layers whose inputs changed re-render, and only the regions they touched
+    are recomposited from the cached layer surfaces.
+    """
+
+    def __init__(self, surface: pygame.Surface, background: Color = Color(0, 0, 0)) -> None:
+        self.surface = surface
+        self.background = background
+        self.layers: List[Layer] = []
+        self._invalid: List[pygame.Rect] = [surface.get_rect()]
+
+    def add(self, name: str, draw: Callable[[pygame.Surface], None],
+            state: Callable[[], Hashable], rect: Callable[[], pygame.Rect]) -> Layer:
+        layer = Layer(name, self.surface.get_size(), draw, state, rect)
+        self.layers.append(layer)
+        return layer
+
+    def invalidate(self, rect: Optional[pygame.Rect] = None) -> None:
+        """Force a region, or the whole surface, to be recomposited next update."""
+        self._invalid.append(self.surface.get_rect() if rect is None else rect)
+
+    def update(self) -> List[pygame.Rect]:
+        """Re-render changed layers, recomposite their regions and return them."""
+        dirty = self._invalid
+        self._invalid = []
+        for layer in self.layers:
+            dirty.extend(layer.update())
+
+        bounds = self.surface.get_rect()
+        dirty = [rect for rect in merge_rects([r.clip(bounds) for r in dirty]) if rect.width and rect.height]
+        with metrics.frame_timer.stage("composite"):
+            for region in dirty:
+                self.surface.fill(self.background, region)
+                self.surface.blits([(layer.surface, region, region) for layer in self.layers
+                                    if layer.last_rect is not None and layer.last_rect.colliderect(region)],
+                                   doreturn=False)
+        return dirty
+
+def present(surface: pygame.Surface, display_surface: pygame.Surface,
+            rects: List[pygame.Rect], scale: int) -> None:
+    """Scale the given regions of surface onto the display and flip only those."""
+    if not rects:
+        return
+    display_rects = []
+    with metrics.frame_timer.stage("scale"):
+        for rect in rects:
+            display_rect = pygame.Rect(rect.x*scale, rect.y*scale, rect.width*scale, rect.height*scale)
+            pygame.transform.scale(surface.subsurface(rect), display_rect.size,
+                dest_surface=display_surface.subsurface(display_rect))
+            display_rects.append(display_rect)
+    with metrics.frame_timer.stage("display"):
+        pygame.display.update(display_rects)
+
+class Preview:
+    """The frame scaled up in a window, refreshed at most fps times a second.
+
+    The window surface keeps its scaled pixels between refreshes, so each
+    refresh rescales and flips only the regions that changed since the last
+    one, with an integer nearest-neighbour scale.
+    """
+
+    def __init__(self, display_surface: pygame.Surface, scale: int, fps: float) -> None:
+        self.display_surface = display_surface
+        self.scale = scale
+        self.interval = 1000 / fps
+        self._pending: List[pygame.Rect] = []
+        self._next = 0.0
+
+    def present(self, surface: pygame.Surface, rects: List[pygame.Rect], now: int) -> None:
+        """Queue rects of surface as changed and refresh if one is due at now (ms)."""
+        self._pending.extend(rects)
+        if now < self._next or not self._pending:
+            return
+        self._next = max(self._next + self.interval, now)
+        rects, self._pending = merge_rects(self._pending), []
+        present(surface, self.display_surface, rects, self.scale)
@@ -0,0 +1,258 @@
+import abc
+import logging
+import mmap
+import os
+import struct
+import time
+from typing import BinaryIO, Callable, Iterable, Optional, Tuple
+
+import pygame
+
+import soundtracks
+
+# A frame store is a header, the distinct frames as raw RGB24 and an index
+# giving, for each frame of the video, which stored frame to show. Repeated
+# frames are stored once.
+MAGIC: bytes = b"TLFS"
+VERSION: int = 1
+HEADER = struct.Struct("<4sHHHdIIQ")  # magic, version, width, height, fps, frames, stored, index offset
+HEADER_SIZE: int = 64
+EXTENSION: str = ".frames"
+
+def store_path(video_path: str) -> str:
+    """Return where the frame store built from video_path lives."""
+    return os.path.splitext(video_path)[0] + EXTENSION
+
+def write_store(file: BinaryIO, size: Tuple[int, int], fps: float, frames: Iterable[bytes]) -> int:
+    """Write frames of RGB24 bytes as a frame store and return the frame count."""
+    width, height = size
+    index = []
+    stored = 0
+    previous = None
+    file.write(bytes(HEADER_SIZE))
+    for frame in frames:
+        if len(frame) != width * height * 3:
+            raise ValueError(f"write_store: frame of {len(frame)} bytes, expected {width}x{height} RGB")
+        if frame != previous:
+            file.write(frame)
+            stored += 1
+            previous = frame
+        index.append(stored - 1)
+
+    index_offset = file.tell()
+    file.write(struct.pack(f"<{len(index)}I", *index))
+    file.seek(0)
+    file.write(HEADER.pack(MAGIC, VERSION, width, height, fps, len(index), stored, index_offset))
+    return len(index)
+
+class FrameStore:
+    """A frame store memory-mapped for playback without decoding."""
+
+    def __init__(self, filepath: str) -> None:
+        self.filepath = filepath
+        with open(filepath, "rb") as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, width, height, fps, frame_count, stored, index_offset = HEADER.unpack_from(self._map)
+        if magic != MAGIC or version != VERSION:
+            self._map.close()
+            raise ValueError(f"FrameStore: {filepath} is not a version {VERSION} frame store")
+        self.size = (width, height)
+        self.fps = fps
+        self.frame_count = frame_count
+        self.stored_count = stored
+        self.frame_bytes = width * height * 3
+        self._buffer = memoryview(self._map)
+        self.index = self._buffer[index_offset:index_offset + 4 * frame_count].cast("I")
+
+    def __len__(self) -> int:
+        return self.frame_count
+
+    @property
+    def duration(self) -> float:
+        return self.frame_count / self.fps
+
+    def stored_frame(self, frame: int) -> int:
+        """Return which stored frame frame shows; repeated frames share one."""
+        return self.index[frame]
+
+    def surface(self, frame: int) -> pygame.Surface:
+        """Return frame as a surface backed directly by the mapped file."""
+        start = HEADER_SIZE + self.stored_frame(frame) * self.frame_bytes
+        return pygame.image.frombuffer(self._buffer[start:start + self.frame_bytes], self.size, "RGB")
+
+    def close(self) -> None:
+        """Unmap the file, or once surfaces returned by surface are freed if any are still alive."""
+        self.index.release()
+        try:
+            self._buffer.release()
+            self._map.close()
+        except BufferError:
+            # The surfaces' buffers keep the map alive; it is unmapped when
+            # the last of them is garbage collected.
+            logging.warning(f"FrameStore: {self.filepath} closed with frames still in use")
+            del self._buffer, self._map
+
+class Playback(abc.ABC):
+    """A real-time playback clock with pyvidplayer2.Video's controls.
+
+    Provides the part of Video's interface that run_game and VideoPool use,
+    so players built on it can stand in for a Video. Subclasses show frames:
+    `_show(frame)` makes a frame current and says whether its picture
+    changed, and `update` advances to the frame due now. Like Video,
+    `active` goes False when the end is reached, unless `loop` is set: then
+    playback carries on from the first frame without rewinding the clock.
+
+    A `soundtrack` plays along while the video plays, and each pass of a
+    looping video is lined up with the soundtrack restarting.
+    """
+
+    def __init__(self, frame_rate: float, time_func: Callable[[], float] = time.perf_counter,
+                 loop: bool = False) -> None:
+        self.frame_rate = frame_rate
+        self.time_func = time_func
+        self.loop = loop
+        self.active = True
+        self.paused = False
+        self.closed = False
+        self.frame = 0
+        self.frame_surf: Optional[pygame.Surface] = None
+        self.soundtrack: Optional[soundtracks.Soundtrack] = None
+        self._start = time_func()
+        self._paused_pos = 0.0
+        self._pass = 0
+
+    def get_pos(self) -> float:
+        """Return the playback position in seconds."""
+        if self.paused:
+            return self._paused_pos
+        return self.time_func() - self._start
+
+    @abc.abstractmethod
+    def _show(self, frame: int) -> bool:
+        """Make frame current and return whether its picture changed."""
+
+    def _seek(self, position: float) -> None:
+        self._show(int(position * self.frame_rate))
+
+    def _pass_frames(self) -> int:
+        """Return the frames in one pass of the video, or 0 while unknown."""
+        return 0
+
+    def _due_frame(self) -> int:
+        """Return the number of the frame due now.
+
+        When a looping video wraps round, the clock is moved to the exact
+        start of the new pass and the soundtrack restarts with it.
+        """
+        frame = int(self.get_pos() * self.frame_rate)
+        frames = self._pass_frames()
+        if self.soundtrack and self.loop and frames and frame // frames != self._pass:
+            self._pass = frame // frames
+            frame -= frame % frames
+            self._start = self.time_func() - frame / self.frame_rate
+            self.soundtrack.play()
+        return frame
+
+    def _sync_soundtrack(self) -> None:
+        """Play the soundtrack from the current position while playing, else silence it."""
+        if not self.soundtrack:
+            return
+        if self.active and not self.paused:
+            position = self.get_pos()
+            frames = self._pass_frames()
+            if self.loop and frames:
+                position %= frames / self.frame_rate
+            self.soundtrack.play(position)
+        else:
+            self.soundtrack.stop()
+
+    def seek(self, time: float, relative: bool = True) -> None:
+        position = max(0.0, self.get_pos() + time if relative else time)
+        self._start = self.time_func() - position
+        self._paused_pos = position
+        frames = self._pass_frames()
+        self._pass = int(position * self.frame_rate) // frames if frames else 0
+        self._seek(position)
+        self._sync_soundtrack()
+
+    def buffer_current(self) -> bool:
+        """Make sure the frame at the current position is ready to draw."""
+        return False
+
+    @abc.abstractmethod
+    def update(self) -> bool:
+        """Advance to the frame due now and return whether its picture is new."""
+
+    def draw(self, surf: pygame.Surface, pos: Tuple[int, int], force_draw: bool = True) -> bool:
+        """Draw the frame due now; unless force_draw, only if it is a new one."""
+        changed = self.update()
+        if self.frame_surf is not None and (changed or force_draw):
+            surf.blit(self.frame_surf, pos)
+        return changed
+
+    def play(self) -> None:
+        if not self.active:
+            self.active = True
+            self._sync_soundtrack()
+
+    def stop(self) -> None:
+        """Rewind and go inactive."""
+        self.active = False
+        self.paused = False
+        self.seek(0, relative=False)
+
+    def restart(self) -> None:
+        self.seek(0, relative=False)
+        self.play()
+
+    def pause(self) -> None:
+        if self.active and not self.paused:
+            self._paused_pos = self.get_pos()
+            self.paused = True
+            self._sync_soundtrack()
+
+    def resume(self) -> None:
+        if self.active and self.paused:
+            self._start = self.time_func() - self._paused_pos
+            self.paused = False
+            self._sync_soundtrack()
+
+    def close(self) -> None:
+        if self.soundtrack:
+            self.soundtrack.stop()
+        self.frame_surf = None
+        self.closed = True
+
+class FramePlayer(Playback):
+    """Plays a FrameStore in real time."""
+
+    def __init__(self, store: FrameStore, time_func: Callable[[], float] = time.perf_counter,
+                 loop: bool = False) -> None:
+        super().__init__(store.fps, time_func, loop)
+        self.store = store
+        self.frame_count = store.frame_count
+        self.duration = store.duration
+
+    def _pass_frames(self) -> int:
+        return self.frame_count
+
+    def _show(self, frame: int) -> bool:
+        frame = frame % self.frame_count if self.loop else min(frame, self.frame_count - 1)
+        stored = self.store.stored_frame(frame)
+        changed = self.frame_surf is None or stored != self.store.stored_frame(self.frame)
+        self.frame = frame
+        if changed:
+            self.frame_surf = self.store.surface(frame)
+        return changed
+
+    def update(self) -> bool:
+        frame = self._due_frame()
+        if frame >= self.frame_count and not self.loop:
+            # stop rewinds, leaving the first frame ready for a restart.
+            self.stop()
+            return True
+        return self._show(frame)
+
+    def close(self) -> None:
+        super().close()
+        self.store.close()
@@ -0,0 +1,131 @@
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+import pygame
+import pygame.freetype
+
+# Printable ASCII and Latin-1, rasterized up front; other characters are
+# added the first time they are drawn.
+DEFAULT_CHARSET: str = "".join(map(chr, range(32, 127))) + "".join(map(chr, range(160, 256)))
+
+Blit = Tuple[pygame.Surface, Tuple[int, int], Optional[pygame.Rect]]
+
+class Glyph(NamedTuple):
+    area: pygame.Rect   # where the glyph is in the atlas
+    rect: pygame.Rect   # ink box: x bearing, top above the baseline, size
+    advance: int
+
+class GlyphAtlas:
+    """A bitmap font's glyphs rasterized once per color into one surface.
+
+    Strings are drawn by blitting each glyph's part of the atlas, laid out
+    as pygame.freetype lays them out, so the atlas draws the same pixels as
+    the font. It provides the get_rect, render and render_to that textrect
+    and run_game use, so it can stand in for the Font; glyph_blits returns
+    the blits for a string so that several strings can share one
+    Surface.blits call. Strings with characters the font has no glyph for
+    are drawn by the font itself.
+    """
+
+    def __init__(self, font: pygame.freetype.Font, charset: Iterable[str] = DEFAULT_CHARSET) -> None:
+        self.font = font
+        self.glyphs: dict[str, Glyph] = {}
+        self.missing: set[str] = set()
+        self.width = 0
+        self.height = 0
+        self._atlases: dict[Tuple[int, int, int, int], pygame.Surface] = {}
+        self._add(charset)
+
+    def _add(self, chars: Iterable[str]) -> None:
+        added = False
+        for char in chars:
+            if char in self.glyphs or char in self.missing:
+                continue
+            metrics = self.font.get_metrics(char)[0]
+            if metrics is None:
+                self.missing.add(char)
+                continue
+            rect = self.font.get_rect(char)
+            self.glyphs[char] = Glyph(pygame.Rect((self.width, 0), rect.size), rect, round(metrics[4]))
+            self.width += rect.width
+            self.height = max(self.height, rect.height)
+            added = True
+        if added:
+            # Rebuilt with the new glyphs when next drawn.
+            self._atlases.clear()
+
+    def _has_glyphs(self, text: str) -> bool:
+        glyphs = self.glyphs
+        if all(char in glyphs for char in text):
+            return True
+        self._add(text)
+        return not any(char in self.missing for char in text)
+
+    def atlas(self, color: pygame.Color) -> pygame.Surface:
+        """Return the surface holding every glyph in color."""
+        key = tuple(pygame.Color(color))
+        surface = self._atlases.get(key)
+        if surface is None:
+            surface = pygame.Surface((max(self.width, 1), max(self.height, 1)), pygame.SRCALPHA)
+            for char, glyph in self.glyphs.items():
+                surface.blit(self.font.render(char, color)[0], glyph.area)
+            self._atlases[key] = surface
+        return surface
+
+    def get_rect(self, text: str) -> pygame.Rect:
+        """Return text's bounding box as pygame.freetype.Font.get_rect does."""
+        if not text or not self._has_glyphs(text):
+            return self.font.get_rect(text)
+        glyphs = self.glyphs
+        # Ink extents: left and right of the pen origin, above and below the baseline.
+        left = 1 << 30
+        right = above = below = -left
+        pen = 0
+        for char in text:
+            glyph = glyphs[char]
+            x, y, width, height = glyph.rect
+            x += pen
+            if x < left:
+                left = x
+            if x + width > right:
+                right = x + width
+            if y > above:
+                above = y
+            if height - y > below:
+                below = height - y
+            pen += glyph.advance
+        return pygame.Rect(left, above, right - left, above + below)
+
+    def glyph_blits(self, text: str, color: pygame.Color, dest: Tuple[int, int]) -> List[Blit]:
+        """Return the blits drawing text with its bounding box's top left at dest."""
+        if not text:
+            return []
+        if not self._has_glyphs(text):
+            return [(self.font.render(text, color)[0], dest, None)]
+        return self._glyph_blits(text, color, dest, self.get_rect(text))
+
+    def _glyph_blits(self, text: str, color: pygame.Color, dest: Tuple[int, int], box: pygame.Rect) -> List[Blit]:
+        atlas = self.atlas(color)
+        glyphs = self.glyphs
+        x, y = dest[0] - box.x, dest[1] + box.y
+        blits = []
+        for char in text:
+            glyph = glyphs[char]
+            blits.append((atlas, (x + glyph.rect.x, y - glyph.rect.y), glyph.area))
+            x += glyph.advance
+        return blits
+
+    def render_to(self, surface: pygame.Surface, dest: Tuple[int, int], text: str,
+                  fgcolor: pygame.Color) -> pygame.Rect:
+        """Draw text onto surface with its bounding box's top left at dest."""
+        if not text or not self._has_glyphs(text):
+            return self.font.render_to(surface, dest, text, fgcolor)
+        box = self.get_rect(text)
+        surface.blits(self._glyph_blits(text, fgcolor, dest, box), doreturn=False)
+        return pygame.Rect(dest, box.size)
+
+    def render(self, text: str, fgcolor: pygame.Color) -> Tuple[pygame.Surface, pygame.Rect]:
+        """Return text drawn on a new surface just big enough, and its box."""
+        rect = self.get_rect(text)
+        surface = pygame.Surface(rect.size, pygame.SRCALPHA)
+        self.render_to(surface, (0, 0), text, fgcolor)
+        return surface, rect
@@ -1,22 +1,147 @@
+import multiprocessing
+import os
 import platform
+import pwd
+import threading
 
+import numpy as np
 from PIL import Image
 import pygame
-from pygame.image import tobytes
-from pygame.time import get_ticks
+import pygame.surfarray
 
-if platform.system() != "Darwin":
-    from rgbmatrix import graphics, RGBMatrix, RGBMatrixOptions
-    import rgbmatrix
-else:
-    from RGBMatrixEmulator import graphics, RGBMatrix, RGBMatrixOptions
-    import RGBMatrixEmulator
-from typing import Union
+from typing import Optional, Union
 
-matrix: RGBMatrix = None
-offscreen_canvas: Union["RGBMatrixEmulator.emulation.canvas.Canvas","RGBMatrix.Canvas"]
+import metrics
+import panelmap
+import sharedframes
+
+# Frames where at most this many pixels changed are written with SetPixel;
+# the rest are pushed whole with SetImage.
+SET_PIXEL_LIMIT: int = 512
+# Color correction applied to every frame; see ColorCorrection. The matrix
+# library already corrects luminance (CIE1931) itself, so the default gamma
+# of 1 leaves levels alone; a higher gamma darkens dim colors further and
+# rounds the dimmest to black.
+GAMMA: float = float(os.environ.get("HUB75_GAMMA", 1.0))
+BRIGHTNESS: float = float(os.environ.get("HUB75_BRIGHTNESS", 100))
+# "inline" drives the matrix from this process, "process" from a separate
+# driver process and "record" from a driver process that records frames to
+# RECORD_FILE instead of showing them.
+DRIVER: str = os.environ.get("HUB75_DRIVER", "inline")
+RECORD_FILE: str = os.environ.get("HUB75_RECORD_FILE", "hub75_frames.npy")
+# Whether to give up root once a driver process owns the matrix.
+DROP_PRIVILEGES: bool = os.environ.get("HUB75_DROP_PRIVILEGES", "1") not in ("", "0")
+
+def default_layout() -> panelmap.PanelLayout:
+    """The panel layout for this platform, overridable with the LED_* env vars."""
+    if platform.system() == "Darwin":
+        rows, cols, chain, rotate = 128, 128, 1, 0
+    else:
+        rows, cols, chain, rotate = 32, 64, 2, 180
+    return panelmap.PanelLayout(
+        rows=int(os.environ.get("LED_ROWS", rows)),
+        cols=int(os.environ.get("LED_COLS", cols)),
+        chain=int(os.environ.get("LED_CHAIN", chain)),
+        parallel=int(os.environ.get("LED_PARALLEL", 1)),
+        mapper=os.environ.get("LED_PIXEL_MAPPER", ""),
+        rotate=int(os.environ.get("LED_ROTATE", rotate)),
+        flip_x=os.environ.get("LED_FLIP_X", "") not in ("", "0"),
+        flip_y=os.environ.get("LED_FLIP_Y", "") not in ("", "0"))
+
+layout: panelmap.PanelLayout = default_layout()
+matrix: Union["RGBMatrixEmulator.RGBMatrix", "rgbmatrix.RGBMatrix", "NullMatrix"] = None
+writer: Optional["CanvasWriter"] = None
+output: Optional["OutputThread"] = None
+driver: Optional[multiprocessing.Process] = None
+shared: Optional[sharedframes.SharedFrameBuffer] = None
+frame_signal: Optional["multiprocessing.connection.Connection"] = None
+# Frames published after the driver process went away.
+driver_dropped: int = 0
+# Updates skipped because the screen had not changed.
+unchanged: int = 0
+
+class NullCanvas:
+    """Stand-in for a matrix canvas that discards everything drawn on it."""
+
+    def __init__(self, width: int, height: int) -> None:
+        self.width = width
+        self.height = height
+
+    def SetImage(self, image: Image.Image, offset_x: int = 0, offset_y: int = 0, unsafe: bool = True) -> None:
+        pass
+
+    def SetPixel(self, x: int, y: int, red: int, green: int, blue: int) -> None:
+        pass
+
+    def Clear(self) -> None:
+        pass
+
+class NullMatrix:
+    """Stand-in for RGBMatrix for running without a panel, e.g. benchmarks."""
+
+    def __init__(self, width: int = 128, height: int = 128) -> None:
+        self.width = width
+        self.height = height
+        self.swap_count = 0
+
+    def CreateFrameCanvas(self) -> NullCanvas:
+        return NullCanvas(self.width, self.height)
+
+    def SwapOnVSync(self, canvas: NullCanvas) -> NullCanvas:
+        self.swap_count += 1
+        return canvas
+
+class RecordingCanvas:
+    """Stand-in canvas that keeps the RGB pixels drawn on it."""
+
+    def __init__(self, width: int, height: int) -> None:
+        self.width = width
+        self.height = height
+        self.pixels = np.zeros((height, width, 3), np.uint8)
+
+    def SetImage(self, image: Image.Image, offset_x: int = 0, offset_y: int = 0, unsafe: bool = True) -> None:
+        region = self.pixels[offset_y:offset_y + image.height, offset_x:offset_x + image.width]
+        region[...] = np.asarray(image.convert("RGB"))[:region.shape[0], :region.shape[1]]
+
+    def SetPixel(self, x: int, y: int, red: int, green: int, blue: int) -> None:
+        self.pixels[y, x] = red, green, blue
+
+    def Clear(self) -> None:
+        self.pixels[...] = 0
+
+class RecordingMatrix:
+    """Stand-in for RGBMatrix that records every frame swapped onto it.
+
+    Like the real matrix, SwapOnVSync hands back the canvas that was being
+    shown, with its old contents, so recordings catch incremental writes
+    that go wrong.
+    """
+
+    def __init__(self, width: int = 128, height: int = 128) -> None:
+        self.width = width
+        self.height = height
+        self.front = RecordingCanvas(width, height)
+        self.frames: list[np.ndarray] = []
+
+    def CreateFrameCanvas(self) -> RecordingCanvas:
+        return RecordingCanvas(self.width, self.height)
+
+    def SwapOnVSync(self, canvas: RecordingCanvas) -> RecordingCanvas:
+        self.frames.append(canvas.pixels.copy())
+        self.front, canvas = canvas, self.front
+        return canvas
+
+    def save(self, filepath: str) -> None:
+        """Save the frames as one (frames, height, width, 3) array."""
+        np.save(filepath, np.stack(self.frames) if self.frames
+                else np.zeros((0, self.height, self.width, 3), np.uint8))
+
+def create_rgbmatrix(layout: panelmap.PanelLayout) -> Union["RGBMatrixEmulator.RGBMatrix", "rgbmatrix.RGBMatrix"]:
+    if platform.system() != "Darwin":
+        from rgbmatrix import RGBMatrix, RGBMatrixOptions
+    else:
+        from RGBMatrixEmulator import RGBMatrix, RGBMatrixOptions
 
-def create_rgbmatrix() -> Union["RGBMatrixEmulator.RGBMatrix", "rgbmatrix.RGBMatrix"]:
     options = RGBMatrixOptions()
 
     options.brightness = 100
@@ -31,46 +156,384 @@ def create_rgbmatrix() -> Union["RGBMatrixEmulator.RGBMatrix", "rgbmatrix.RGBMat
     options.pwm_lsb_nanoseconds = 130
     options.row_address_type = 0
 
-    if platform.system() == "Darwin":
-        options.rows = 128
-        options.cols = 128
-        options.chain_length = 1
-        options.parallel = 1
-    else:
-        options.rows = 32
-        options.cols = 64
-        options.chain_length = 2
-        options.parallel = 1
+    # Rotation and pixel mapping are done by FrameBuffer.load with the
+    # layout's remap, so the library is given the panels as wired.
+    options.rows = layout.rows
+    options.cols = layout.cols
+    options.chain_length = layout.chain
+    options.parallel = layout.parallel
 
     #sudo examples-api-use/demo -D0 --led-no-hardware-pulse --led-cols=64 --led-rows=32 --led-slowdown-gpio=5 --led-multiplexing=1 --led-pixel-mapper=U-mapper --led-chain 8 --led-parallel=3
 
     return RGBMatrix(options=options)
 
 
-def init() -> None:
-    global matrix, offscreen_canvas
+class ColorCorrection:
+    """Per-channel gamma, white balance and brightness applied by lookup.
+
+    A channel value v becomes 255 * (v/255)**gamma * white * brightness/100.
+    Each packed pixel is corrected as two 16-bit halves, each looked up in
+    its own 65536-entry table, so a frame costs a copy, an add and a take.
+    The tables also clear the unused fourth byte, and are rebuilt on the
+    next frame after a setting changes.
+    """
+
+    def __init__(self, gamma: float = GAMMA, white_balance: tuple[float, float, float] = (1.0, 1.0, 1.0),
+                 brightness: float = BRIGHTNESS) -> None:
+        self.gamma = gamma
+        self.white_balance = white_balance
+        self.brightness = brightness
+        self.table: Optional[np.ndarray] = None
+        self.shifts: Optional[tuple[int, int, int]] = None
+        self._offsets: Optional[np.ndarray] = None
+        self._indices: Optional[np.ndarray] = None
+
+    def configure(self, gamma: Optional[float] = None, white_balance: Optional[tuple[float, float, float]] = None,
+                  brightness: Optional[float] = None) -> None:
+        if gamma is not None:
+            self.gamma = gamma
+        if white_balance is not None:
+            self.white_balance = white_balance
+        if brightness is not None:
+            self.brightness = brightness
+        self.table = None
+
+    def channel_table(self, channel: int) -> np.ndarray:
+        """Return the 256 corrected levels of channel 0, 1 or 2 (red, green, blue)."""
+        levels = np.arange(256) / 255
+        scale = 255 * self.white_balance[channel] * self.brightness / 100
+        return np.clip(np.rint(levels ** self.gamma * scale), 0, 255).astype(np.uint16)
+
+    def build(self, shifts: tuple[int, int, int]) -> None:
+        byte_tables = [np.zeros(256, np.uint16) for _ in range(4)]
+        for channel, shift in enumerate(shifts):
+            byte_tables[shift // 8] = self.channel_table(channel)
+        values = np.arange(65536)
+        low, high = values & 0xff, values >> 8
+        self.table = np.concatenate((byte_tables[0][low] | byte_tables[1][high] << 8,
+                                     byte_tables[2][low] | byte_tables[3][high] << 8))
+        self.shifts = shifts
+
+    def apply(self, pixels: np.ndarray, shifts: tuple[int, int, int]) -> None:
+        """Correct packed pixels in place."""
+        if self.table is None or shifts != self.shifts:
+            self.build(shifts)
+        halves = pixels.reshape(-1).view(np.uint16)
+        if self._indices is None or len(self._indices) != len(halves):
+            # The high half of each pixel is looked up in the second table.
+            # Both are intp, so take uses the indices without copying them.
+            self._offsets = np.tile(np.array((0, 65536), np.intp), len(halves) // 2)
+            self._indices = np.empty(len(halves), np.intp)
+        # Widened by a plain copy, as adding across dtypes would buffer a cast.
+        np.copyto(self._indices, halves)
+        np.add(self._indices, self._offsets, out=self._indices)
+        np.take(self.table, self._indices, out=halves, mode="clip")
+
+    def settings(self) -> dict:
+        return {"gamma": self.gamma, "white_balance": list(self.white_balance), "brightness": self.brightness}
+
+class FrameBuffer:
+    """A persistent panel frame and a PIL image kept for pushing it whole.
+
+    Pixels are kept packed as uint32 in the screen's own 32-bit format, color
+    corrected and with alpha cleared, so frames are copied and compared one
+    word per pixel. They are laid out as the matrix is wired, gathered from
+    the screen through the layout's precomputed remap. Both buffers are
+    allocated on the first load and then rewritten in place.
+    """
 
-    matrix = create_rgbmatrix()
-    offscreen_canvas = matrix.CreateFrameCanvas()
+    def __init__(self) -> None:
+        self.pixels: Optional[np.ndarray] = None
+        self.image: Optional[Image.Image] = None
+        self.shifts: tuple[int, int, int] = (0, 8, 16)
+        self.rawmode = "RGBX"
 
-last_image: bytes = b''
-update_count = 0
-total_time = 1
-def update(screen: pygame.Surface) -> None:
-    global last_image, total_time,update_count
-    pixels = tobytes(screen, "RGB")
-    if pixels == last_image:
+    def load(self, screen: pygame.Surface) -> None:
+        """Copy the screen in, mapped onto the panels."""
+        remap = layout.remap(screen.get_size())
+        self.allocate(remap.size, tuple(screen.get_shifts()[:3]))
+        # Row-major screen pixels; a view unless the surface pitch is padded.
+        source = pygame.surfarray.pixels2d(screen).T.reshape(-1)
+        remap.apply(source, self.pixels.reshape(-1))
+        with metrics.frame_timer.stage("color"):
+            color_correction.apply(self.pixels, self.shifts)
+
+    def allocate(self, size: tuple[int, int], shifts: tuple[int, int, int]) -> None:
+        """Size the buffers for frames of size packed with the given shifts."""
+        width, height = size
+        if self.pixels is None or self.pixels.shape != (height, width):
+            self.pixels = np.empty((height, width), np.uint32)
+            self.image = Image.new("RGB", (width, height))
+        if shifts != self.shifts:
+            self.shifts = shifts
+            channels = {shift // 8: channel for channel, shift in zip("RGB", self.shifts)}
+            self.rawmode = "".join(channels.get(byte, "X") for byte in range(4))
+
+    def to_image(self) -> Image.Image:
+        self.image.frombytes(self.pixels, "raw", self.rawmode)
+        return self.image
+
+    def rgb(self, indices: np.ndarray) -> list[tuple[int, int, int]]:
+        """Return the colors of the pixels at the given flat indices."""
+        red, green, blue = self.shifts
+        return [((p >> red) & 0xff, (p >> green) & 0xff, (p >> blue) & 0xff)
+                for p in self.pixels.ravel()[indices].tolist()]
+
+class CanvasWriter:
+    """Writes frames to the matrix through its pair of frame canvases.
+
+    The canvas being written is the one SwapOnVSync handed back, which still
+    holds the frame from two swaps ago, so each canvas keeps a copy of the
+    last frame written to it and only the pixels that differ are rewritten.
+    The rgbmatrix binding wraps the canvas it hands back in a new object on
+    every swap, so the two canvases are told apart by swap parity; a matrix
+    that hands back the canvas it was given, as the emulator does, has just
+    the one.
+    """
+
+    def __init__(self, matrix) -> None:
+        self.matrix = matrix
+        self.canvas = matrix.CreateFrameCanvas()
+        # The last frame written to each canvas, and which canvas is being
+        # written and which was swapped in last.
+        self.shadows: list[Optional[np.ndarray]] = [None, None]
+        self.back = 0
+        self.front: Optional[int] = None
+        self._changed: Optional[np.ndarray] = None
+        self.counters: dict[str, int] = {"skipped": 0, "partial": 0, "full": 0, "pixels": 0}
+
+    def write(self, frame: FrameBuffer) -> None:
+        """Show frame on the panel, blocking until the swap at vsync."""
+        pixels = frame.pixels
+        if self._changed is None or self._changed.shape != pixels.shape:
+            self._changed = np.empty(pixels.shape, bool)
+            self.shadows = [None, None]
+            self.front = None
+
+        front = self.shadows[self.front] if self.front is not None else None
+        if front is not None and not np.not_equal(pixels, front, out=self._changed).any():
+            self.counters["skipped"] += 1
+            return
+
+        previous = self.shadows[self.back]
+        if previous is None:
+            previous = self.shadows[self.back] = np.empty_like(pixels)
+            changed = pixels.size
+        else:
+            changed = np.count_nonzero(np.not_equal(pixels, previous, out=self._changed))
+
+        if changed > SET_PIXEL_LIMIT:
+            self.canvas.SetImage(frame.to_image())
+            self.counters["full"] += 1
+        else:
+            indices = np.flatnonzero(self._changed)
+            width = pixels.shape[1]
+            for index, (r, g, b) in zip(indices.tolist(), frame.rgb(indices)):
+                self.canvas.SetPixel(index % width, index // width, r, g, b)
+            self.counters["partial"] += 1
+        self.counters["pixels"] += int(changed)
+
+        np.copyto(previous, pixels)
+        self.front = self.back
+        swapped = self.matrix.SwapOnVSync(self.canvas)
+        if swapped is not self.canvas:
+            self.back ^= 1
+        self.canvas = swapped
+
+class OutputThread(threading.Thread):
+    """Pushes frames to the panel so the render loop never waits on vsync.
+
+    Frames are triple buffered: the render loop fills `back` and submits it,
+    swapping it with the pending buffer, and this thread swaps the pending
+    buffer out to write it. Only the most recently submitted frame is kept: a
+    frame still pending when a newer one arrives is coalesced into it, and
+    frames submitted after the thread stopped are dropped.
+    """
+
+    def __init__(self, writer: CanvasWriter) -> None:
+        super().__init__(name="hub75 output", daemon=True)
+        self.writer = writer
+        self.back = FrameBuffer()
+        self.counters: dict[str, int] = {"submitted": 0, "presented": 0, "coalesced": 0, "dropped": 0}
+        self._pending = FrameBuffer()
+        self._has_pending = False
+        self._writing = FrameBuffer()
+        self._running = True
+        self._condition = threading.Condition()
+
+    def submit(self) -> None:
+        """Hand the filled back buffer over and take a free one in its place."""
+        with self._condition:
+            self.counters["submitted"] += 1
+            if not self._running:
+                self.counters["dropped"] += 1
+                return
+            if self._has_pending:
+                self.counters["coalesced"] += 1
+            self.back, self._pending = self._pending, self.back
+            self._has_pending = True
+            self._condition.notify()
+
+    def run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._has_pending and self._running:
+                    self._condition.wait()
+                if not self._running:
+                    return
+                self._writing, self._pending = self._pending, self._writing
+                self._has_pending = False
+            self.writer.write(self._writing)
+            self.counters["presented"] += 1
+
+    def stop(self) -> None:
+        with self._condition:
+            self._running = False
+            if self._has_pending:
+                self.counters["dropped"] += 1
+                self._has_pending = False
+            self._condition.notify()
+        self.join()
+
+color_correction = ColorCorrection()
+frame_buffer = FrameBuffer()
+
+def run_driver(signal: "multiprocessing.connection.Connection", panel_layout: panelmap.PanelLayout,
+               record_file: Optional[str]) -> None:
+    """Driver process: show frames published to shared memory until the game exits.
+
+    The first message on signal names the shared buffer; after that each
+    message says a frame was published. Once the pipe closes, the last
+    frame published is shown before the process exits. The buffer is
+    attached before the matrix is created, since creating it drops root.
+    """
+    size = panel_layout.matrix_size
+    frames = sharedframes.SharedFrameBuffer(size, signal.recv())
+    driver_matrix = RecordingMatrix(*size) if record_file else create_rgbmatrix(panel_layout)
+    driver_writer = CanvasWriter(driver_matrix)
+    frame = FrameBuffer()
+    frame.allocate(size, frame.shifts)
+    closed = False
+    try:
+        while not closed:
+            try:
+                signal.recv_bytes()
+                while signal.poll(0):
+                    signal.recv_bytes()
+            except EOFError:
+                # The game has exited; still show the last frame it published.
+                closed = True
+            shifts = frames.read(frame.pixels)
+            if shifts is None:
+                continue
+            frame.allocate(size, shifts)
+            driver_writer.write(frame)
+            frames.mark_presented()
+    finally:
+        frames.close()
+        if record_file:
+            driver_matrix.save(record_file)
+
+def start_driver(record_file: Optional[str] = None) -> None:
+    """Start a process that will own the matrix; attach_driver then feeds it."""
+    global driver, frame_signal
+
+    context = multiprocessing.get_context("spawn")
+    receiver, frame_signal = context.Pipe(duplex=False)
+    driver = context.Process(target=run_driver, name="hub75 driver", args=(receiver, layout, record_file))
+    driver.start()
+    receiver.close()
+
+def attach_driver() -> None:
+    """Create the shared frame buffer and hand it to the driver process.
+
+    Done after dropping privileges, so that this process can unlink it.
+    """
+    global shared
+
+    shared = sharedframes.SharedFrameBuffer(layout.matrix_size)
+    frame_signal.send(shared.name)
+
+def drop_privileges() -> None:
+    """Switch from root to the user who ran sudo, or to daemon as rgbmatrix does."""
+    if os.geteuid() != 0:
         return
-    last_image = pixels
-    img = Image.frombytes("RGB", (screen.get_width(), screen.get_height()), pixels)
+    if "SUDO_UID" in os.environ:
+        uid, gid = int(os.environ["SUDO_UID"]), int(os.environ["SUDO_GID"])
+    else:
+        entry = pwd.getpwnam("daemon")
+        uid, gid = entry.pw_uid, entry.pw_gid
+    # Keep the user's supplementary groups, such as audio, video and input,
+    # which pygame needs once it opens the mixer and display.
+    os.initgroups(pwd.getpwuid(uid).pw_name, gid)
+    os.setgid(gid)
+    os.setuid(uid)
 
-    if platform.system() != "Darwin":
-# mypy: disable-error-code=attr-defined
-        img = img.rotate(180, Image.NEAREST, expand=1)
-
-    start = get_ticks()
-    offscreen_canvas.SetImage(img)
-    matrix.SwapOnVSync(offscreen_canvas)
-    total_time += get_ticks() - start
-    update_count += 1
-    # print(f"fps: {1000*update_count/total_time}")
+def init(stand_in: Optional[NullMatrix] = None, threaded: bool = True,
+         panel_layout: Optional[panelmap.PanelLayout] = None, driver_mode: str = DRIVER) -> None:
+    global layout, matrix, writer, output
+
+    layout = panel_layout or layout
+    metrics.register("hub75", stats)
+    if stand_in is None and driver_mode in ("process", "record"):
+        start_driver(RECORD_FILE if driver_mode == "record" else None)
+        if DROP_PRIVILEGES:
+            drop_privileges()
+        attach_driver()
+        return
+
+    matrix = stand_in or create_rgbmatrix(layout)
+    writer = CanvasWriter(matrix)
+    if threaded:
+        output = OutputThread(writer)
+        output.start()
+
+def shutdown() -> None:
+    global driver, shared, frame_signal
+
+    if output:
+        output.stop()
+    if driver:
+        # The driver exits when the pipe closes.
+        frame_signal.close()
+        driver.join(5)
+        if driver.is_alive():
+            driver.terminate()
+        shared.close()
+        driver = shared = frame_signal = None
+
+def stats() -> dict:
+    result: dict = {"color": color_correction.settings(), "unchanged": unchanged}
+    if writer:
+        result.update(writer.counters)
+    if output:
+        result.update(output.counters)
+    if shared:
+        result.update(published=shared.published, presented=shared.presented, dropped=driver_dropped)
+    return result
+
+def update(screen: pygame.Surface, changed: bool = True) -> None:
+    """Push the screen to the panel, writing only the pixels that changed.
+
+    Pass changed=False when nothing was drawn since the last update, to skip
+    reading the screen at all. A new color correction is still pushed.
+    """
+    global driver_dropped, unchanged
+
+    # configure drops the table, so a setting change forces a push.
+    if not changed and color_correction.table is not None:
+        unchanged += 1
+        return
+    if shared:
+        frame_buffer.load(screen)
+        shared.publish(frame_buffer.pixels, frame_buffer.shifts)
+        try:
+            frame_signal.send_bytes(b"")
+        except BrokenPipeError:
+            driver_dropped += 1
+    elif output:
+        output.back.load(screen)
+        output.submit()
+    else:
+        frame_buffer.load(screen)
+        writer.write(frame_buffer)
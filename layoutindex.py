@@ -0,0 +1,118 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Optional, Sequence, Tuple
+
+import pygame
+
+import textrect
+
+# Bump when the way text is laid out changes, so cached layouts are rebuilt.
+LAYOUT_VERSION: int = 2
+
+def cache_key(timeline_path: str, font_path: str, font_size: int, size: Tuple[int, int]) -> str:
+    """Return the hash cached layouts are valid for."""
+    digest = hashlib.sha256(f"{LAYOUT_VERSION} {font_size} {size[0]}x{size[1]}".encode())
+    for path in (font_path, timeline_path):
+        with open(path, "rb") as file:
+            digest.update(hashlib.sha256(file.read()).digest())
+    return digest.hexdigest()
+
+class LayoutIndex:
+    """The wrapped layout of every event's text, laid out once and kept on disk.
+
+    Layouts are made by a TextRectRenderer and handed back to it, so that
+    drawing an event's text needs no layout. They are saved to a cache file
+    along with a cache_key, and the next start loads them from it if the key
+    and the texts still match.
+
+    Texts that overflow the rect are reported as the index loads. They are
+    drawn cut to the lines that fit, or not at all if a word is too wide.
+    """
+
+    def __init__(self, renderer: textrect.TextRectRenderer) -> None:
+        self.renderer = renderer
+        self.layouts: dict[str, textrect.Layout] = {}
+        self.overflows: dict[str, str] = {}
+        self.cached = False
+        self.build_ms = 0.0
+
+    def load(self, texts: Sequence[str], cache_path: str, key: str) -> None:
+        """Load the layouts of texts from cache_path, or lay them out and save them there."""
+        self.cached = bool(cache_path) and self._read(texts, cache_path, key)
+        if not self.cached:
+            self.build(texts)
+            if cache_path:
+                self._write(texts, cache_path, key)
+        for text, message in self.overflows.items():
+            logging.warning(f"LayoutIndex: {text!r} doesn't fit in {self.renderer.size}: {message}")
+        self.renderer.layouts.update(self.layouts)
+
+    def build(self, texts: Sequence[str]) -> None:
+        start = time.perf_counter()
+        self.layouts.clear()
+        self.overflows.clear()
+        for text in texts:
+            try:
+                self.layouts[text] = self.renderer.layout(text)
+                continue
+            except textrect.TextRectException as error:
+                self.overflows[text] = error.message
+            try:
+                self.layouts[text] = self.renderer.clipped_layout(text)
+            except textrect.TextRectException:
+                self.layouts[text] = (pygame.Rect(0, 0, 0, 0), (), ())
+        self.build_ms = (time.perf_counter() - start) * 1e3
+
+    def _read(self, texts: Sequence[str], cache_path: str, key: str) -> bool:
+        try:
+            with open(cache_path, "r") as file:
+                cache = json.load(file)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as error:
+            logging.warning(f"LayoutIndex: {cache_path}: {error}")
+            return False
+        if not isinstance(cache, dict):
+            logging.warning(f"LayoutIndex: {cache_path}: malformed cache: not a JSON object")
+            return False
+        if cache.get("key") != key:
+            return False
+        try:
+            events = cache["events"]
+            if [event["text"] for event in events] != list(texts):
+                return False
+            for event in events:
+                self.layouts[event["text"]] = (pygame.Rect(event["last_rect"]), tuple(event["lines"]),
+                                               tuple(event["heights"]))
+                if event["overflow"] is not None:
+                    self.overflows[event["text"]] = event["overflow"]
+        except (KeyError, TypeError, AttributeError) as error:
+            self.layouts.clear()
+            self.overflows.clear()
+            logging.warning(f"LayoutIndex: {cache_path}: malformed cache: {error!r}")
+            return False
+        return True
+
+    def _write(self, texts: Sequence[str], cache_path: str, key: str) -> None:
+        events = []
+        for text in texts:
+            last_rect, lines, heights = self.layouts[text]
+            events.append({"text": text, "lines": lines, "heights": heights, "last_rect": tuple(last_rect),
+                           "overflow": self.overflows.get(text)})
+        partial = cache_path + ".partial"
+        try:
+            with open(partial, "w") as file:
+                json.dump({"key": key, "events": events}, file)
+            os.replace(partial, cache_path)
+        except OSError as error:
+            logging.warning(f"LayoutIndex: {cache_path}: {error}")
+
+    def get(self, text: str) -> Optional[textrect.Layout]:
+        return self.layouts.get(text)
+
+    def stats(self) -> dict[str, int | float | bool]:
+        return {"layouts": len(self.layouts), "overflows": len(self.overflows),
+                "cached": self.cached, "build_ms": self.build_ms}
@@ -0,0 +1,87 @@
+import json
+import time
+from array import array
+from typing import Callable, Dict
+
+class RingBuffer:
+    """Fixed-size buffer of the most recent samples."""
+
+    def __init__(self, size: int) -> None:
+        self._samples = array('d', bytes(8 * size))
+        self._size = size
+        self._next = 0
+        self.count = 0
+
+    def append(self, value: float) -> None:
+        self._samples[self._next] = value
+        self._next = (self._next + 1) % self._size
+        self.count += 1
+
+    def values(self) -> list[float]:
+        return list(self._samples[:min(self.count, self._size)])
+
+def percentile(ordered: list[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+class Stage:
+    """Context manager that records its elapsed time into a ring buffer."""
+
+    def __init__(self, samples: RingBuffer) -> None:
+        self.samples = samples
+        self._start = 0
+
+    def __enter__(self) -> "Stage":
+        self._start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.samples.append((time.perf_counter_ns() - self._start) / 1e6)
+
+class StageTimer:
+    """Per-stage timings, in milliseconds, of the last `size` frames."""
+
+    def __init__(self, size: int = 1024) -> None:
+        self.size = size
+        self._stages: Dict[str, Stage] = {}
+
+    def stage(self, name: str) -> Stage:
+        stage = self._stages.get(name)
+        if stage is None:
+            stage = self._stages[name] = Stage(RingBuffer(self.size))
+        return stage
+
+    def record(self, name: str, milliseconds: float) -> None:
+        self.stage(name).samples.append(milliseconds)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        summary = {}
+        for name, stage in self._stages.items():
+            ordered = sorted(stage.samples.values())
+            if not ordered:
+                continue
+            summary[name] = {
+                "count": stage.samples.count,
+                "p50": percentile(ordered, 0.50),
+                "p95": percentile(ordered, 0.95),
+                "p99": percentile(ordered, 0.99),
+                "max": ordered[-1],
+            }
+        return summary
+
+frame_timer = StageTimer()
+sources: Dict[str, Callable[[], dict]] = {}
+
+def register(name: str, source: Callable[[], dict]) -> None:
+    """Include the dict returned by source under name in every snapshot."""
+    sources[name] = source
+
+def snapshot() -> dict:
+    result = {"stages": frame_timer.summary()}
+    for name, source in sources.items():
+        result[name] = source()
+    return result
+
+def dump(filepath: str) -> None:
+    with open(filepath, 'w') as file:
+        json.dump(snapshot(), file, indent=2)
@@ -0,0 +1,122 @@
+from typing import Tuple
+
+import numpy as np
+
+class Remap:
+    """A precomputed gather from a source frame to the matrix's pixel order.
+
+    `index[i]` is the flat source pixel shown at flat matrix pixel i. Matrix
+    pixels that show nothing are listed in `blank` and cleared after the
+    gather.
+    """
+
+    def __init__(self, index: np.ndarray, blank: np.ndarray, size: Tuple[int, int]) -> None:
+        self.index = index
+        self.blank = blank
+        self.size = size
+
+    def apply(self, source: np.ndarray, out: np.ndarray) -> None:
+        """Gather flat source pixels into the flat matrix frame out."""
+        # Indices are always in range; "clip" lets take write out unbuffered.
+        np.take(source, self.index, out=out, mode="clip")
+        if len(self.blank):
+            out[self.blank] = 0
+
+class PanelLayout:
+    """How a chain of HUB75 panels is wired and how the image is oriented.
+
+    rows, cols, chain and parallel match the RGBMatrixOptions of the same
+    names. mapper may be "" or "U-mapper", which folds a long chain into a U
+    the same way the library's pixel mapper of that name does. rotate (a
+    multiple of 90 degrees, clockwise) and the flips are applied to the image
+    before it is mapped onto the panels.
+    """
+
+    def __init__(self, rows: int, cols: int, chain: int = 1, parallel: int = 1, mapper: str = "",
+                 rotate: int = 0, flip_x: bool = False, flip_y: bool = False) -> None:
+        if rotate % 90:
+            raise ValueError(f"PanelLayout: rotation must be a multiple of 90, not {rotate}")
+        if mapper not in ("", "U-mapper"):
+            raise ValueError(f"PanelLayout: unknown mapper {mapper}")
+        if mapper == "U-mapper" and (chain < 2 or chain % 2):
+            raise ValueError("PanelLayout: U-mapper needs an even chain of at least 2 panels")
+        self.rows = rows
+        self.cols = cols
+        self.chain = chain
+        self.parallel = parallel
+        self.mapper = mapper
+        self.rotate = rotate % 360
+        self.flip_x = flip_x
+        self.flip_y = flip_y
+        self._remaps: dict[Tuple[int, int], Remap] = {}
+
+    @property
+    def matrix_size(self) -> Tuple[int, int]:
+        """The (width, height) of the canvas as wired."""
+        return self.cols * self.chain, self.rows * self.parallel
+
+    @property
+    def visible_size(self) -> Tuple[int, int]:
+        """The (width, height) of the display once the mapper is applied."""
+        width, height = self.matrix_size
+        if self.mapper == "U-mapper":
+            return (width // 64) * 32, 2 * height
+        return width, height
+
+    def visible_to_matrix(self, x: np.ndarray, y: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        if self.mapper != "U-mapper":
+            return x, y
+
+        matrix_width, matrix_height = self.matrix_size
+        visible_width = self.visible_size[0]
+        panel_height = matrix_height // self.parallel
+        slab_height = 2 * panel_height
+        base_y = (y // slab_height) * panel_height
+        y = y % slab_height
+        upper = y < panel_height
+        matrix_x = np.where(upper, x + matrix_width // 2, visible_width - x - 1)
+        matrix_y = np.where(upper, y, slab_height - y - 1)
+        return matrix_x, base_y + matrix_y
+
+    def visible_to_source(self, x: np.ndarray, y: np.ndarray,
+                          source_size: Tuple[int, int]) -> Tuple[np.ndarray, np.ndarray]:
+        visible_width, visible_height = self.visible_size
+        if self.flip_x:
+            x = visible_width - 1 - x
+        if self.flip_y:
+            y = visible_height - 1 - y
+
+        width, height = source_size
+        if self.rotate == 90:
+            return y, height - 1 - x
+        if self.rotate == 180:
+            return width - 1 - x, height - 1 - y
+        if self.rotate == 270:
+            return width - 1 - y, x
+        return x, y
+
+    def remap(self, source_size: Tuple[int, int]) -> Remap:
+        """Return the gather from a row-major source frame of source_size."""
+        remap = self._remaps.get(source_size)
+        if remap is None:
+            remap = self._remaps[source_size] = self._build_remap(source_size)
+        return remap
+
+    def _build_remap(self, source_size: Tuple[int, int]) -> Remap:
+        width, height = source_size
+        visible_width, visible_height = self.visible_size
+        matrix_width, matrix_height = self.matrix_size
+
+        y, x = np.mgrid[0:visible_height, 0:visible_width]
+        x, y = x.ravel(), y.ravel()
+        source_x, source_y = self.visible_to_source(x, y, source_size)
+        matrix_x, matrix_y = self.visible_to_matrix(x, y)
+
+        shown = (0 <= source_x) & (source_x < width) & (0 <= source_y) & (source_y < height)
+        shown &= (matrix_x < matrix_width) & (matrix_y < matrix_height)
+        index = np.zeros(matrix_width * matrix_height, np.intp)
+        covered = np.zeros(matrix_width * matrix_height, bool)
+        target = matrix_y[shown] * matrix_width + matrix_x[shown]
+        index[target] = source_y[shown] * width + source_x[shown]
+        covered[target] = True
+        return Remap(index, np.flatnonzero(~covered), (matrix_width, matrix_height))
@@ -0,0 +1,41 @@
+import logging
+import os
+from typing import Iterable, Optional
+
+import pygame
+
+# A poster is a video's first frame at panel size, built by assets.py.
+EXTENSION: str = ".poster.png"
+
+def poster_path(video_path: str) -> str:
+    """Return where the poster of video_path lives."""
+    return os.path.splitext(video_path)[0] + EXTENSION
+
+class PosterCache:
+    """The posters of event videos, loaded into memory once at startup.
+
+    A video event shows its poster as soon as it is reached and swaps in the
+    live video once the video has opened. The poster is the video's first
+    frame, so the swap doesn't show.
+    """
+
+    def __init__(self) -> None:
+        self.posters: dict[str, pygame.Surface] = {}
+
+    def load(self, video_paths: Iterable[str]) -> None:
+        """Load the posters of video_paths that have been built."""
+        for video_path in video_paths:
+            filepath = poster_path(video_path)
+            if video_path in self.posters or not os.path.exists(filepath):
+                continue
+            try:
+                self.posters[video_path] = pygame.image.load(filepath)
+            except (pygame.error, OSError) as error:
+                logging.warning(f"PosterCache: {filepath}: {error}")
+
+    def get(self, video_path: str) -> Optional[pygame.Surface]:
+        return self.posters.get(video_path)
+
+    def stats(self) -> dict[str, int]:
+        return {"posters": len(self.posters),
+                "bytes": sum(poster.get_pitch() * poster.get_height() for poster in self.posters.values())}
@@ -0,0 +1,180 @@
+from multiprocessing import shared_memory
+from typing import Optional, Tuple
+
+import numpy as np
+
+# Header words, each a uint64 at the start of the shared block.
+SEQUENCE = 0        # number of frames published so far
+LATEST = 1          # slot holding the most recently published frame
+SLOT_SEQUENCES = 2  # one per slot: odd while the slot is being written
+SHIFTS = 4          # red, green and blue shifts of the packed pixels
+PRESENTED = 7       # frames the reader has shown, written by the reader
+HEADER_WORDS = 8
+SLOTS = 2
+
+class SharedFrameBuffer:
+    """A double-buffered frame of packed uint32 pixels in shared memory.
+
+    One process publishes frames, alternating between two slots, and another
+    reads the most recent one. Each slot has its own sequence counter that is
+    odd while the slot is being written, so a reader that overlapped a write
+    sees the counter change and copies again instead of showing a torn frame.
+    """
+
+    def __init__(self, size: Tuple[int, int], name: Optional[str] = None) -> None:
+        width, height = size
+        self.size = size
+        nbytes = 8 * HEADER_WORDS + SLOTS * 4 * width * height
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=nbytes if self.owner else 0)
+        self.header = np.ndarray((HEADER_WORDS,), np.uint64, self.shm.buf)
+        self.slots = np.ndarray((SLOTS, height, width), np.uint32, self.shm.buf, offset=8 * HEADER_WORDS)
+        if self.owner:
+            self.header[:] = 0
+        self.last_sequence = 0
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def publish(self, pixels: np.ndarray, shifts: Tuple[int, int, int]) -> None:
+        """Copy a frame into the slot not holding the latest one and publish it."""
+        slot = 1 - int(self.header[LATEST]) if self.header[SEQUENCE] else 0
+        self.header[SLOT_SEQUENCES + slot] += 1
+        np.copyto(self.slots[slot], pixels)
+        self.header[SHIFTS:SHIFTS + 3] = shifts
+        self.header[SLOT_SEQUENCES + slot] += 1
+        self.header[LATEST] = slot
+        self.header[SEQUENCE] += 1
+
+    def read(self, out: np.ndarray) -> Optional[Tuple[int, int, int]]:
+        """Copy the latest frame into out if one arrived since the last read.
+
+        Returns the frame's shifts, or None if there was no new frame.
+        """
+        sequence = int(self.header[SEQUENCE])
+        if sequence == self.last_sequence:
+            return None
+        while True:
+            slot = int(self.header[LATEST])
+            before = int(self.header[SLOT_SEQUENCES + slot])
+            if before % 2 == 0:
+                np.copyto(out, self.slots[slot])
+                shifts = tuple(int(shift) for shift in self.header[SHIFTS:SHIFTS + 3])
+                if int(self.header[SLOT_SEQUENCES + slot]) == before:
+                    break
+            sequence = int(self.header[SEQUENCE])
+        self.last_sequence = sequence
+        return shifts
+
+    @property
+    def published(self) -> int:
+        return int(self.header[SEQUENCE])
+
+    @property
+    def presented(self) -> int:
+        return int(self.header[PRESENTED])
+
+    def mark_presented(self) -> None:
+        self.header[PRESENTED] += 1
+
+    def close(self) -> None:
+        # Drop the views first; shared memory can't close while they exist.
+        del self.header, self.slots
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+# Ring header words.
+WRITTEN = 0  # frames put so far, written by the producer
+READ = 1     # frames taken so far, written by the consumer
+ENDED = 2    # 1 + the generation whose stream ended, or 0
+LENGTH = 3   # frames in one pass of a looping stream once known, or 0
+CACHED = 4   # leading frames the consumer keeps itself, written by the consumer
+RING_HEADER_WORDS = 8
+
+class SharedFrameRing:
+    """A ring of RGB24 frames in shared memory, from one producer to one consumer.
+
+    Each frame carries the generation of the stream it belongs to and its
+    frame number within it, so a consumer that switches streams can discard
+    frames of the old one. The producer must wait while the ring is full,
+    which bounds how far it runs ahead.
+    """
+
+    def __init__(self, size: Tuple[int, int], slots: int = 8, name: Optional[str] = None) -> None:
+        width, height = size
+        self.size = size
+        self.slot_count = slots
+        nbytes = 8 * (RING_HEADER_WORDS + 2 * slots) + slots * 3 * width * height
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=nbytes if self.owner else 0)
+        self.header = np.ndarray((RING_HEADER_WORDS,), np.uint64, self.shm.buf)
+        self.labels = np.ndarray((slots, 2), np.uint64, self.shm.buf, offset=8 * RING_HEADER_WORDS)
+        self.frames = np.ndarray((slots, height, width, 3), np.uint8, self.shm.buf,
+                                 offset=8 * (RING_HEADER_WORDS + 2 * slots))
+        if self.owner:
+            self.header[:] = 0
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def __len__(self) -> int:
+        return int(self.header[WRITTEN] - self.header[READ])
+
+    def full(self) -> bool:
+        return len(self) >= self.slot_count
+
+    def put(self, frame: bytes, generation: int, number: int) -> None:
+        """Producer: append a frame. The ring must not be full."""
+        slot = int(self.header[WRITTEN]) % self.slot_count
+        self.frames[slot] = np.frombuffer(frame, np.uint8).reshape(self.frames.shape[1:])
+        self.labels[slot] = generation, number
+        self.header[WRITTEN] += 1
+
+    def end(self, generation: int) -> None:
+        """Producer: mark the stream of generation as complete."""
+        self.header[ENDED] = generation + 1
+
+    def ended(self, generation: int) -> bool:
+        return int(self.header[ENDED]) == generation + 1
+
+    @property
+    def length(self) -> int:
+        return int(self.header[LENGTH])
+
+    @length.setter
+    def length(self, frames: int) -> None:
+        self.header[LENGTH] = frames
+
+    @property
+    def cached(self) -> int:
+        """How many frames from the start of the stream the consumer holds.
+
+        The producer need not put those frames again.
+        """
+        return int(self.header[CACHED])
+
+    @cached.setter
+    def cached(self, frames: int) -> None:
+        self.header[CACHED] = frames
+
+    def peek(self, offset: int = 0) -> Tuple[int, int, np.ndarray]:
+        """Consumer: return (generation, number, pixels) of a waiting frame.
+
+        The pixels stay valid until the frame is taken.
+        """
+        slot = (int(self.header[READ]) + offset) % self.slot_count
+        generation, number = self.labels[slot]
+        return int(generation), int(number), self.frames[slot]
+
+    def take(self, count: int = 1) -> None:
+        """Consumer: free the oldest count waiting frames."""
+        self.header[READ] += count
+
+    def close(self) -> None:
+        del self.header, self.labels, self.frames
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
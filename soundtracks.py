@@ -0,0 +1,66 @@
+import logging
+import os
+from typing import Optional
+
+import pygame
+
+# A soundtrack is a video's audio as 16-bit PCM WAV at the mixer's rate,
+# built by assets.py.
+EXTENSION: str = ".wav"
+# pygame's default mixer format.
+DEFAULT_RATE: int = 44100
+CHANNELS: int = 2
+# The mixer channel kept for soundtracks; one video plays at a time.
+CHANNEL: int = 0
+
+def soundtrack_path(video_path: str) -> str:
+    """Return where the soundtrack of video_path lives."""
+    return os.path.splitext(video_path)[0] + EXTENSION
+
+class Soundtrack:
+    """A video's audio, decoded ahead of time and held in memory.
+
+    Playing it only hands the samples to the mixer, on a channel reserved so
+    that other sounds never take it over.
+    """
+
+    def __init__(self, filepath: str) -> None:
+        pygame.mixer.set_reserved(CHANNEL + 1)
+        self.filepath = filepath
+        self.sound = pygame.mixer.Sound(filepath)
+        self.channel = pygame.mixer.Channel(CHANNEL)
+        self._raw: Optional[bytes] = None
+        self._playing: Optional[pygame.mixer.Sound] = None
+
+    def play(self, position: float = 0.0) -> None:
+        """Play from position seconds on, in place of whatever the channel plays."""
+        if position <= 0:
+            self._playing = self.sound
+        else:
+            # A Sound always plays from its start, so play a copy of the rest.
+            frequency, size, channels = pygame.mixer.get_init()
+            offset = int(position * frequency) * (abs(size) // 8 * channels)
+            if self._raw is None:
+                self._raw = self.sound.get_raw()
+            if offset >= len(self._raw):
+                self.stop()
+                return
+            self._playing = pygame.mixer.Sound(buffer=self._raw[offset:])
+        self.channel.play(self._playing)
+
+    def stop(self) -> None:
+        """Silence the channel if it is still playing this soundtrack."""
+        if self._playing is not None and self.channel.get_sound() is self._playing:
+            self.channel.stop()
+        self._playing = None
+
+def load(video_path: str) -> Optional[Soundtrack]:
+    """Load the soundtrack of video_path, if it has been built and there is a mixer."""
+    filepath = soundtrack_path(video_path)
+    if not pygame.mixer.get_init() or not os.path.exists(filepath):
+        return None
+    try:
+        return Soundtrack(filepath)
+    except pygame.error as error:
+        logging.warning(f"soundtracks.load: {filepath}: {error}")
+        return None
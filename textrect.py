@@ -1,9 +1,22 @@
 #! /usr/bin/env python
 
-import functools
+from typing import Optional
+
 import pygame
+
+import glyphatlas
+from boundedcache import BoundedCache, surface_bytes
 # https://www.pygame.org/pcr/text_rect/index.php
 
+DEFAULT_MAX_RECTS: int = 256
+DEFAULT_MAX_LINES: int = 256
+DEFAULT_MAX_BLOCKS: int = 64
+# For each of the line and block caches of a renderer.
+DEFAULT_MAX_BYTES: int = 2 * 1024 * 1024
+
+# The last line's rect, the lines and the height each is drawn at.
+Layout = tuple[pygame.Rect, tuple[str, ...], tuple[int, ...]]
+
 class TextRectException(BaseException):
     def __init__(self, message: str) -> None:
         self.message = message
@@ -12,47 +25,212 @@ class TextRectException(BaseException):
         return self.message
 
 class FontRectGetter():
-    def __init__(self, font: pygame.freetype.Font) -> None:
-        self._font = font
+    """Measures text in one font, and wraps lines of it.
 
-    @functools.lru_cache(maxsize=64)
-    def get_rect(self, text: str):
-        return self._font.get_rect(text)
+    wrap packs words into lines from a table of each character's ink
+    extent and advance, so that wrapping a line takes time linear in its
+    length. Ink boxes and advances add up exactly for unkerned bitmap
+    fonts, so that gives the same lines as measuring each longer prefix of
+    the line, which is what wrap does for any other font.
+    """
+
+    def __init__(self, font: pygame.freetype.Font | glyphatlas.GlyphAtlas, max_rects: int = DEFAULT_MAX_RECTS) -> None:
+        self._font = font
+        self.rects: BoundedCache[pygame.Rect] = BoundedCache(max_entries=max_rects)
+        self._metrics_font = font.font if isinstance(font, glyphatlas.GlyphAtlas) else font
+        self._additive = not self._metrics_font.scalable and not self._metrics_font.kerning
+        # Ink left and right of the pen origin and advance, or None if the font has no glyph.
+        self._glyphs: dict[str, Optional[tuple[int, int, int]]] = {}
+
+    def get_rect(self, text: str) -> pygame.Rect:
+        rect = self.rects.get(text)
+        if rect is None:
+            rect = self.rects.put(text, self._font.get_rect(text))
+        return rect
+
+    def _glyph(self, char: str) -> Optional[tuple[int, int, int]]:
+        metrics = self._metrics_font.get_metrics(char)[0]
+        if metrics is None:
+            glyph = None
+        else:
+            rect = self._metrics_font.get_rect(char)
+            glyph = (rect.x, rect.right, round(metrics[4]))
+        self._glyphs[char] = glyph
+        return glyph
+
+    def _measure(self, word: str) -> Optional[tuple[int, int, int]]:
+        """Return word's ink left and right of its pen origin and its advance."""
+        glyphs = self._glyphs
+        left = 1 << 30
+        right = -left
+        pen = 0
+        for char in word:
+            glyph = glyphs[char] if char in glyphs else self._glyph(char)
+            if glyph is None:
+                return None
+            x, x_right, advance = glyph
+            if pen + x < left:
+                left = pen + x
+            if pen + x_right > right:
+                right = pen + x_right
+            pen += advance
+        return left, right, pen
+
+    def wrap(self, line: str, width: int) -> list[str]:
+        """Break line between words into lines narrower than width."""
+        words = line.split(' ')
+        space = self._measure(' ') if self._additive else None
+        measured = [self._measure(word) for word in words] if space else [None]
+        if None in measured:
+            return self._wrap_prefixes(words, width)
+
+        for word, (word_left, word_right, _) in zip(words, measured):
+            if word_right - word_left >= width:
+                raise TextRectException("The word " + word + " is too long to fit in the rect passed.")
+
+        # Each candidate line ends in a space, whose box counts towards its width.
+        space_left, space_right, space_advance = space
+        lines = []
+        start = 0
+        left = 1 << 30
+        right = -left
+        pen = 0
+        for index, (word_left, word_right, advance) in enumerate(measured):
+            word_left += pen
+            word_right += pen
+            space_x = pen + advance
+            test_left = left if left < word_left else word_left
+            if space_x + space_left < test_left:
+                test_left = space_x + space_left
+            test_right = right if right > word_right else word_right
+            if space_x + space_right > test_right:
+                test_right = space_x + space_right
+            if test_right - test_left < width:
+                left, right = test_left, test_right
+                pen = space_x + space_advance
+            else:
+                lines.append(' '.join(words[start:index]))
+                start = index
+                left = min(word_left - pen, advance + space_left)
+                right = max(word_right - pen, advance + space_right)
+                pen = advance + space_advance
+        lines.append(' '.join(words[start:]))
+        return lines
+
+    def _wrap_prefixes(self, words: list[str], width: int) -> list[str]:
+        # if any of our words are too long to fit, return.
+        for word in words:
+            if self.get_rect(word).width >= width:
+                raise TextRectException("The word " + word + " is too long to fit in the rect passed.")
+
+        # Start a new line
+        lines = []
+        accumulated_line = ""
+        for word in words:
+            test_line = accumulated_line + word + " "
+
+            # Build the line while the words fit.
+            if self.get_rect(test_line).width < width:
+                accumulated_line = test_line
+            else:
+                lines.append(accumulated_line[:-1])
+                accumulated_line = word + " "
+        lines.append(accumulated_line[:-1])
+        return lines
 
 class Blitter():
-    def __init__(self, font: pygame.freetype.Font, color: pygame.Color, rect: pygame.Rect) -> None:
+    """Assembles blocks of rendered lines, caching both lines and blocks.
+
+    Each distinct line is rendered once into its own surface, and a block
+    is built by blitting its lines onto one new surface in a single pass.
+    With a GlyphAtlas for the font, lines are instead drawn straight from
+    the atlas in that same pass, without a surface per line. Both caches
+    belong to the instance and drop their least recently used entries
+    beyond max_lines and max_blocks, or beyond max_bytes of surfaces each.
+    """
+
+    def __init__(self, font: pygame.freetype.Font | glyphatlas.GlyphAtlas, color: pygame.Color, rect: pygame.Rect,
+                 max_lines: int = DEFAULT_MAX_LINES, max_blocks: int = DEFAULT_MAX_BLOCKS,
+                 max_bytes: int = DEFAULT_MAX_BYTES) -> None:
         self._font = font
         self._color = color
         self._rect = rect
+        self.lines: BoundedCache[pygame.Surface] = BoundedCache(max_lines, max_bytes, surface_bytes)
+        self.blocks: BoundedCache[pygame.Surface] = BoundedCache(max_blocks, max_bytes, surface_bytes)
 
-    def _render_blit(self, surface: pygame.Surface, line: str, height: int) -> pygame.Surface:
-        surface.blit(self._font.render(line, self._color)[0], (0, height))
+    def _line(self, line: str) -> pygame.Surface:
+        surface = self.lines.get(line)
+        if surface is None:
+            surface = self.lines.put(line, self._font.render(line, self._color)[0])
         return surface
 
-    @functools.lru_cache(maxsize=64)
-    def blit(self, lines: tuple[str], heights: tuple[int]) -> pygame.Surface:
-        if len(lines) == 0:
-            return pygame.Surface(self._rect.size, pygame.SRCALPHA)
-        if len(lines) == 1:
-            return self._render_blit(self.blit((), ()).copy(), lines[0], heights[0])
+    def _line_blits(self, line: str, height: int) -> list[glyphatlas.Blit]:
+        if isinstance(self._font, glyphatlas.GlyphAtlas):
+            return self._font.glyph_blits(line, self._color, (0, height))
+        return [(self._line(line), (0, height), None)]
+
+    def blit(self, lines: tuple[str, ...], heights: tuple[int, ...]) -> pygame.Surface:
+        key = (lines, heights)
+        surface = self.blocks.get(key)
+        if surface is not None:
+            return surface
 
-        previous_lines_surface = self.blit(tuple(lines[:-1]), tuple(heights[:-1])).copy()
-        return self._render_blit(previous_lines_surface, lines[-1], heights[-1])
+        surface = pygame.Surface(self._rect.size, pygame.SRCALPHA)
+        surface.blits([blit for line, height in zip(lines, heights) for blit in self._line_blits(line, height)],
+                      doreturn=False)
+        return self.blocks.put(key, surface)
 
 class TextRectRenderer():
-    def __init__(self, font: pygame.freetype.Font, rect: pygame.Rect, color: pygame.Color) -> None:
+    """Draws word-wrapped text into a rect.
+
+    Strings are laid out each time they are drawn, unless their layout has
+    been put in layouts ahead of time, as layoutindex.LayoutIndex does.
+    """
+
+    def __init__(self, font: pygame.freetype.Font | glyphatlas.GlyphAtlas, rect: pygame.Rect, color: pygame.Color,
+                 max_rects: int = DEFAULT_MAX_RECTS, max_lines: int = DEFAULT_MAX_LINES,
+                 max_blocks: int = DEFAULT_MAX_BLOCKS, max_bytes: int = DEFAULT_MAX_BYTES) -> None:
         self._font = font
         self._rect = rect
         self._color = color
-        self._font_rect_getter = FontRectGetter(font)
-        self._blitter = Blitter(font, color, rect)
+        self._font_rect_getter = FontRectGetter(font, max_rects)
+        self._blitter = Blitter(font, color, rect, max_lines, max_blocks, max_bytes)
+        self.layouts: dict[str, Layout] = {}
+
+    @property
+    def size(self) -> tuple[int, int]:
+        return self._rect.size
+
+    def layout(self, string: str) -> Layout:
+        layout = self.layouts.get(string)
+        if layout is None:
+            layout = prerender_textrect(string, self._blitter, self._font, self._rect, self._color,
+                                        self._font_rect_getter)
+        return layout
+
+    def clipped_layout(self, string: str) -> Layout:
+        """Lay string out keeping only the lines that fit in the rect's height."""
+        rg = self._font_rect_getter
+        tall = pygame.Rect(self._rect.topleft, (self._rect.width, 1 << 30))
+        _, lines, heights = prerender_textrect(string, self._blitter, self._font, tall, self._color, rg)
+        count = 0
+        while count < len(lines) and heights[count] + rg.get_rect(lines[count]).height < self._rect.height:
+            count += 1
+        if not count:
+            raise TextRectException("Not even one line of the text string fits in the rect.")
+        last_rect = pygame.Rect((0, heights[count - 1]), rg.get_rect(lines[count - 1]).size)
+        return last_rect, lines[:count], heights[:count]
 
     def render(self, string: str) -> pygame.Surface:
-        return render_textrect(string, self._blitter, self._font, self._rect, self._color, self._font_rect_getter)
+        _, lines, heights = self.layout(string)
+        return self._blitter.blit(lines, heights)
 
     def get_last_rect(self, string: str) -> pygame.Rect:
-        return get_last_textrect(string, self._blitter, self._font,
-            self._rect, self._color, self._font_rect_getter)
+        return self.layout(string)[0]
+
+    def stats(self) -> dict[str, dict[str, Optional[int]]]:
+        return {"rects": self._font_rect_getter.rects.stats(),
+                "lines": self._blitter.lines.stats(), "blocks": self._blitter.blocks.stats()}
 
 def prerender_textrect(string: str, blitter: Blitter, font: pygame.freetype.Font, rect: pygame.Rect,
     text_color: pygame.Color, rg: FontRectGetter,
@@ -66,32 +244,10 @@ def prerender_textrect(string: str, blitter: Blitter, font: pygame.freetype.Font
 
     for requested_line in requested_lines:
         if rg.get_rect(requested_line).width > rect.width:
-            words = requested_line.split(' ')
-
-            # if any of our words are too long to fit, return.
-            for word in words:
-                last_rect = rg.get_rect(word)
-                if last_rect.width >= rect.width:
-                    raise TextRectException("The word " + word + " is too long to fit in the rect passed.")
-
-            # Start a new line
-            accumulated_line = ""
-            for word in words:
-                test_line = accumulated_line + word + " "
-
-                # Build the line while the words fit.
-                if rg.get_rect(test_line).width < rect.width:
-                    accumulated_line = test_line
-                else:
-                    final_lines.append(accumulated_line[:-1])
-                    last_rect = rg.get_rect(accumulated_line[:-1])
-                    accumulated_line = word + " "
-            final_lines.append(accumulated_line[:-1])
-            last_rect = rg.get_rect(accumulated_line[:-1])
+            final_lines.extend(rg.wrap(requested_line, rect.width))
         else:
             final_lines.append(requested_line)
-            last_rect = rg.get_rect(requested_line)
-
+        last_rect = rg.get_rect(final_lines[-1]).copy()
 
     accumulated_height = 0
     accumulated_lines = []
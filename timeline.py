@@ -2,19 +2,21 @@
 
 # Standard library imports
 import asyncio
+import logging
 import math
 import os
 import platform
 import re
+import signal
 import string
 import sys
+import time
 from functools import reduce
-from typing import Callable, List, Tuple, Optional, Dict
+from typing import Callable, Iterable, List, Tuple, Optional, Dict
 import json
 
 # Third-party imports
 import aiomqtt
-from PIL import Image, ImageDraw
 import pygame
 import pygame.gfxdraw
 from pygame import Color
@@ -23,6 +25,16 @@ from pyvidplayer2 import Video
 import textrect
 
 # Local imports
+import compositor
+import framestore
+import glyphatlas
+import layoutindex
+import metrics
+import pie
+import posters
+import soundtracks
+import videopool
+import videoproc
 from pygameasync import Clock
 from get_key import get_key
 import my_inputs
@@ -34,22 +46,54 @@ SCREEN_WIDTH: int = 128
 SCREEN_HEIGHT: int = 128
 MQTT_SERVER: str = os.environ.get("MQTT_SERVER", "localhost")
 FPS: int = 30
+GUESS_HEIGHT: int = 16
+METRICS_INTERVAL: float = float(os.environ.get("METRICS_INTERVAL", 10))
+METRICS_DUMP_FILE: str = os.environ.get("METRICS_DUMP_FILE", "metrics.json")
+PIE_CACHE_BYTES: int = int(os.environ.get("PIE_CACHE_BYTES", pie.DEFAULT_MAX_BYTES))
+TEXT_CACHE_BYTES: int = int(os.environ.get("TEXT_CACHE_BYTES", textrect.DEFAULT_MAX_BYTES))
+PIE_WARMUP: bool = os.environ.get("PIE_WARMUP", "") not in ("", "0")
+# "window" shows a scaled-up preview; "none" runs without creating a window.
+PREVIEW: str = os.environ.get("PREVIEW", "window")
+PREVIEW_FPS: float = float(os.environ.get("PREVIEW_FPS", FPS))
+# "inline" decodes videos without frame stores with pyvidplayer2 in this
+# process; "process" decodes them in a separate decoder process per video.
+VIDEO_DECODER: str = os.environ.get("VIDEO_DECODER", "inline")
+VIDEO_POOL_SIZE: int = int(os.environ.get("VIDEO_POOL_SIZE", videopool.DEFAULT_MAX_OPEN))
+# "freetype" draws text with pygame.freetype; "atlas" blits glyphs from a
+# glyphatlas.GlyphAtlas, which draws the same pixels.
+FONT_BACKEND: str = os.environ.get("FONT_BACKEND", "freetype")
+TIMELINE_FILE: str = "timeline.json"
+DESCRIPTION_FONT_FILE: str = "scientifica-11.bdf"
+DESCRIPTION_FONT_SIZE: int = 11
+# Where the layouts of the event descriptions are kept between runs; "" keeps none.
+LAYOUT_CACHE_FILE: str = os.environ.get("LAYOUT_CACHE_FILE", "timeline.layout.json")
 
+# To decode the event videos to panel-sized frame stores, run assets.py.
 # To convert the video to a smaller size:
 # ffmpeg -i images/dinosaurs.mov -vf "scale=96:96:force_original_aspect_ratio=increase,crop=128:128" \
 # -c:a copy images/dinosaurs_128.mov
 
 class TimelineGame:
-    def __init__(self):
+    def __init__(self, time_func: Callable[[], int] = pygame.time.get_ticks,
+                 key_source: Callable[[], Iterable[Tuple[str, bool]]] = get_key):
+        self.time_func = time_func
+        self.key_source = key_source
         self.quit_app: bool = False
-        self.video: Optional[Video] = None
+        self.video: Optional[videopool.Playable] = None
+        self.video_path: Optional[str] = None
+        # Counts new video frames, so the video layer redraws only for those.
+        self.video_frames: int = 0
+        self.video_pool = videopool.VideoPool(self.open_video, VIDEO_POOL_SIZE)
+        self.posters = posters.PosterCache()
         self.events: List[Dict[str, float | str]] = []
         self.clock: Optional[Clock] = None
         self.display_surface: Optional[pygame.Surface] = None
+        self.preview: Optional[compositor.Preview] = None
         self.screen: Optional[pygame.Surface] = None
-        self.font_guess: Optional[pygame.freetype.Font] = None
-        self.font_small: Optional[pygame.freetype.Font] = None
+        self.font_guess: Optional[pygame.freetype.Font | glyphatlas.GlyphAtlas] = None
+        self.font_small: Optional[pygame.freetype.Font | glyphatlas.GlyphAtlas] = None
         self.textrecter: Optional[textrect.TextRectRenderer] = None
+        self.layout_index: Optional[layoutindex.LayoutIndex] = None
         self.letters: str = ""
         self.guess: str = ""
         self.current_position: int = 0
@@ -57,24 +101,147 @@ class TimelineGame:
         self.start_movement: int = 0
         self.angle: int = 0
         self.last_position: int = 0
+        self.frame: int = 0
+        self.compositor: Optional[compositor.Compositor] = None
+        self.pie_cache: pie.PieCache = pie.PieCache(PIE_CACHE_BYTES)
 
     def load_timeline_data(self, filepath: str) -> List[Dict[str, float | str]]:
         """Load timeline data from JSON file."""
         with open(filepath, 'r') as file:
             return json.load(file)
 
-    def draw_pie(self, surface: pygame.Surface, color: Color, center: Tuple[int, int], 
+    def draw_pie(self, surface: pygame.Surface, color: Color, center: Tuple[int, int],
                  radius: int, start_angle: float, end_angle: float) -> None:
         """Draw a pie slice on the surface."""
-        large_size = (radius*8, radius*8)
-        pil_image = Image.new("RGBA", large_size)
-        draw = ImageDraw.Draw(pil_image)
-        draw.pieslice([(0, 0), large_size], start=start_angle, end=end_angle, fill=tuple(color))
-        pil_image = pil_image.resize((radius*2, radius*2), resample=Image.Resampling.LANCZOS)
+        surface.blit(self.pie_cache.get([(color, (0, 0), radius, start_angle, end_angle)]), center)
 
-        data = pil_image.tobytes()
-        s = pygame.image.frombytes(data, pil_image.size, pil_image.mode).convert_alpha()
-        surface.blit(s, center)
+    def draw_pies(self, surface: pygame.Surface, slices: List[pie.PieSlice]) -> None:
+        """Draw overlapping pie slices in order as one composited sprite."""
+        surface.blit(self.pie_cache.get(slices), pie.slices_rect(slices))
+
+    def pie_slices(self, angle: int) -> List[pie.PieSlice]:
+        """Return the (color, center, radius, start, end) of each animated pie."""
+        slices = []
+        for color, smaller, divisor in ((Color(0, 80, 0, 30), 10, 10),
+                                        (Color(80, 80, 0, 100), 20, 40),
+                                        (Color(80, 0, 0, 50), 0, 1)):
+            slices.append((color, (32+smaller, 32+smaller), 32-smaller, 270, angle/divisor))
+        return slices
+
+    def warm_pie_cache(self) -> None:
+        """Pre-render every pie slice for a full 0-360 sweep of the animation."""
+        for angle in range(360):
+            self.pie_cache.get(self.pie_slices(angle))
+
+    def open_video(self, filepath: str) -> Optional[videopool.Playable]:
+        """Open an event's video, or return None if the file is missing.
+
+        Plays the video's frame store, built by assets.py, if it is at least
+        as new as the video; it needs no decoding. Otherwise the video is
+        decoded as VIDEO_DECODER says. Frame stores and decoder processes
+        loop seamlessly and play the soundtrack built by assets.py, if any;
+        run_game restarts pyvidplayer2 videos, which decode their own audio,
+        when they end.
+        """
+        store = framestore.store_path(filepath)
+        if os.path.exists(store) and (not os.path.exists(filepath)
+                                      or os.path.getmtime(store) >= os.path.getmtime(filepath)):
+            player = framestore.FramePlayer(framestore.FrameStore(store), loop=True)
+        elif not os.path.exists(filepath):
+            logging.warning(f"open_video: missing {filepath}")
+            return None
+        elif VIDEO_DECODER == "process":
+            player = videoproc.StreamPlayer(filepath, (SCREEN_WIDTH, SCREEN_HEIGHT), loop=True)
+        else:
+            return Video(filepath, use_pygame_audio=True)
+        player.soundtrack = soundtracks.load(filepath)
+        return player
+
+    def event_video(self, position: int) -> Optional[str]:
+        """Return the video path of the event at position, if it has one."""
+        if 0 <= position < len(self.events):
+            return self.events[position].get("video")
+        return None
+
+    def show_event_video(self) -> None:
+        """Switch to the current event's video and prefetch its neighbors'.
+
+        If the video is still opening, its poster shows until update_video
+        finds it ready.
+        """
+        if self.video_path:
+            self.video_pool.release(self.video_path)
+        self.video_path = self.event_video(self.current_position)
+        self.video = self.video_pool.acquire(self.video_path, wait=False) if self.video_path else None
+        self.prefetch_videos()
+
+    def prefetch_videos(self) -> None:
+        """Start opening the videos of the events either side of the current one."""
+        neighbors = (self.event_video(self.current_position - 1), self.event_video(self.current_position + 1))
+        self.video_pool.prefetch(path for path in neighbors if path)
+
+    def event_text(self, event: Dict[str, float | str]) -> str:
+        """Return the text shown for event."""
+        return f"{self.format_date(event['date'])}: {event['description']}"
+
+    def description_text(self) -> str:
+        """Return the text shown for the current event."""
+        return self.event_text(self.events[self.current_position])
+
+    def update_video(self) -> None:
+        """Advance the video to the frame due now, counting it if it is new."""
+        if self.video is None and self.video_path:
+            self.video = self.video_pool.current_video()
+        if self.video and self.video.update():
+            self.video_frames += 1
+
+    def video_background(self) -> Optional[pygame.Surface]:
+        """Return the current video frame, or the poster until there is one."""
+        if self.video and self.video.frame_surf is not None:
+            return self.video.frame_surf
+        return self.posters.get(self.video_path) if self.video_path else None
+
+    def draw_video(self, surface: pygame.Surface) -> None:
+        """Draw the current video frame or poster as the background."""
+        background = self.video_background()
+        if background:
+            surface.blit(background, (0, 0))
+
+    def draw_description(self, surface: pygame.Surface) -> None:
+        """Draw the word-wrapped date and description of the current event."""
+        surface.blit(self.textrecter.render(self.description_text()), (0, 3))
+
+    def draw_timeline_bar(self, surface: pygame.Surface) -> None:
+        """Draw the timeline indicator bar and the current position on it."""
+        pygame.draw.line(surface, Color("orange"), (0, 0), (128, 0))
+        pygame.draw.circle(surface, Color("red"), (self.current_position+90, 1), 1)
+
+    def guess_text(self) -> str:
+        """Return the guess followed by the blinking cursor."""
+        show_cursor = (self.time_func()*2 // 1000) % 2 == 0
+        return self.guess + ("_" if show_cursor else " ")
+
+    def draw_guess(self, surface: pygame.Surface) -> None:
+        """Draw the guess typed so far along the bottom of the screen."""
+        self.font_guess.render_to(surface, (0, SCREEN_HEIGHT - GUESS_HEIGHT), self.guess_text(), Color("green"))
+
+    def setup_compositor(self) -> compositor.Compositor:
+        """Create the layer stack in back-to-front order."""
+        comp = compositor.Compositor(self.screen)
+        screen_rect = self.screen.get_rect()
+        comp.add("video", self.draw_video,
+            lambda: (id(self.video), id(self.video_background()), self.video_frames),
+            lambda: screen_rect if self.video_background() else pygame.Rect(0, 0, 0, 0))
+        comp.add("pies", lambda surface: self.draw_pies(surface, self.pie_slices(self.angle)),
+            lambda: self.pie_cache.key(self.pie_slices(self.angle)),
+            lambda: pie.slices_rect(self.pie_slices(self.angle)))
+        comp.add("description", self.draw_description, self.description_text,
+            lambda: pygame.Rect(0, 3, 128, 64))
+        comp.add("timeline bar", self.draw_timeline_bar, lambda: self.current_position,
+            lambda: pygame.Rect(0, 0, 129, 3))
+        comp.add("guess", self.draw_guess, self.guess_text,
+            lambda: pygame.Rect(0, SCREEN_HEIGHT - GUESS_HEIGHT, SCREEN_WIDTH, GUESS_HEIGHT))
+        return comp
 
     def format_date(self, line_date: float) -> str:
         """Format the date for display."""
@@ -89,7 +256,7 @@ class TimelineGame:
     def handle_key_input(self, key: str, keydown: bool) -> None:
         """Handle keyboard input."""
         if keydown:
-            self.start_movement = pygame.time.get_ticks()
+            self.start_movement = self.time_func()
             self.last_direction = 1 if key == "right" else -1 if key == "left" else 0
         elif not keydown:
             self.last_direction = 0
@@ -107,94 +274,125 @@ class TimelineGame:
 
     async def run_game(self) -> None:
         """Main game loop."""
-        self.events = self.load_timeline_data("timeline.json")
+        self.events = self.load_timeline_data(TIMELINE_FILE)
         self.video = None
-        self.clock = Clock()
+        self.clock = Clock(time_func=self.time_func)
         
         pygame.freetype.init()
-        self.display_surface = pygame.display.set_mode(
-            (SCREEN_WIDTH*SCALING_FACTOR, SCREEN_HEIGHT*SCALING_FACTOR))
+        if PREVIEW != "none":
+            self.display_surface = pygame.display.set_mode(
+                (SCREEN_WIDTH*SCALING_FACTOR, SCREEN_HEIGHT*SCALING_FACTOR))
+            self.preview = compositor.Preview(self.display_surface, SCALING_FACTOR, PREVIEW_FPS)
         
         self.font_guess = pygame.freetype.Font("raize-13.pcf", 13)
-        self.font_small = pygame.freetype.Font("scientifica-11.bdf", 11)
+        self.font_small = pygame.freetype.Font(DESCRIPTION_FONT_FILE, DESCRIPTION_FONT_SIZE)
+        if FONT_BACKEND == "atlas":
+            self.font_guess = glyphatlas.GlyphAtlas(self.font_guess)
+            self.font_small = glyphatlas.GlyphAtlas(self.font_small)
         self.textrecter = textrect.TextRectRenderer(
-            self.font_small, pygame.Rect(0, 0, 128, 64), Color("green"))
+            self.font_small, pygame.Rect(0, 0, 128, 64), Color("green"), max_bytes=TEXT_CACHE_BYTES)
+        # Lay out every description now, reporting any that don't fit, rather than mid-show.
+        self.layout_index = layoutindex.LayoutIndex(self.textrecter)
+        self.layout_index.load([self.event_text(event) for event in self.events], LAYOUT_CACHE_FILE,
+            layoutindex.cache_key(TIMELINE_FILE, DESCRIPTION_FONT_FILE, DESCRIPTION_FONT_SIZE,
+                                  self.textrecter.size))
         
         self.screen = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT), flags=pygame.SRCALPHA)
-        self.screen = self.screen.convert_alpha()
+        if self.display_surface:
+            self.screen = self.screen.convert_alpha()
+        if PIE_WARMUP:
+            self.warm_pie_cache()
+        self.compositor = self.setup_compositor()
+        metrics.register("pie_cache", self.pie_cache.stats)
+        metrics.register("video_pool", self.video_pool.stats)
+        metrics.register("posters", self.posters.stats)
+        metrics.register("text", self.textrecter.stats)
+        metrics.register("layouts", self.layout_index.stats)
+        self.posters.load(event["video"] for event in self.events if "video" in event)
+        self.prefetch_videos()
 
         while not self.quit_app:
+            frame_start = time.perf_counter_ns()
             self.angle = (self.angle + 1) % 360
-            
-            self.screen.fill((0, 0, 0))
-            if self.video:
-                if not self.video.active:
-                    self.video.restart()
-                self.video.draw(self.screen, (0, 0), force_draw=True)
+            self.frame += 1
+
+            if self.video and not self.video.active:
+                self.video.restart()
 
             # Update video when position changes
             if self.current_position != self.last_position:
-                current_event = self.events[self.current_position]
-                if "video" in current_event:
-                    self.video = Video(current_event["video"], use_pygame_audio=True)
-                else:
-                    self.video = None
+                self.show_event_video()
                 self.last_position = self.current_position
+            self.update_video()
 
-            # Draw pie animations
-            smaller = 10
-            self.draw_pie(self.screen, Color(0, 80, 0, 30), 
-                         (32+smaller, 32+smaller), 32-smaller, 270, self.angle/10)
-            smaller = 20
-            self.draw_pie(self.screen, Color(80, 80, 0, 100), 
-                         (32+smaller, 32+smaller), 32-smaller, 270, self.angle/40)
-            self.draw_pie(self.screen, Color(80, 0, 0, 50), 
-                         (32, 32), 32, 270, self.angle)
-
-            # Draw timeline
-            show_cursor = (pygame.time.get_ticks()*2 // 1000) % 2 == 0
-            print_guess = self.guess + ("_" if show_cursor else " ")
-            current_event = self.events[self.current_position]
-            date = current_event["date"]
-            description = current_event["description"]
-            disp_date = self.format_date(date)
-
-            rendered = self.textrecter.render(f"{disp_date}: {description}")
-            self.screen.blit(rendered, (0, 3))
-
-            # Draw timeline indicator
-            pygame.draw.line(self.screen, Color("orange"), (0, 0), (128, 0))
-            pygame.draw.circle(self.screen, Color("red"), (self.current_position+90, 1), 1)
+            # Re-render the layers whose inputs changed and composite them
+            dirty = self.compositor.update()
 
             # Handle input
-            for key, keydown in get_key():
+            for key, keydown in self.key_source():
                 self.handle_key_input(key, keydown)
 
             # Update display
-            hub75.update(self.screen)
-            pygame.transform.scale(self.screen,
-                self.display_surface.get_rect().size, dest_surface=self.display_surface)
-            pygame.display.update()
-            
+            with metrics.frame_timer.stage("hub75"):
+                hub75.update(self.screen, changed=bool(dirty))
+            if self.preview:
+                self.preview.present(self.screen, dirty, self.time_func())
+            metrics.frame_timer.record("frame", (time.perf_counter_ns() - frame_start) / 1e6)
+
             await self.clock.tick(FPS)
 
+        self.video_pool.close()
+
+def configure_hub75(setting: str, payload: str) -> None:
+    """Apply a timeline/hub75/<setting> message to the panel's color correction.
+
+    gamma and brightness (0-100) take a number, white_balance three
+    comma-separated channel scales.
+    """
+    try:
+        if setting == "gamma":
+            hub75.color_correction.configure(gamma=float(payload))
+        elif setting == "brightness":
+            hub75.color_correction.configure(brightness=float(payload))
+        elif setting == "white_balance":
+            red, green, blue = (float(value) for value in payload.split(","))
+            hub75.color_correction.configure(white_balance=(red, green, blue))
+        else:
+            logging.warning(f"configure_hub75: unknown setting {setting}")
+    except ValueError:
+        logging.warning(f"configure_hub75: bad {setting} {payload!r}")
+
 async def trigger_events_from_mqtt(subscribe_client: aiomqtt.Client, game: TimelineGame) -> None:
     """Handle MQTT events."""
     async for message in subscribe_client.messages:
         if message.topic.matches("password_game/quit"):
             game.quit_app = True
+        elif message.topic.matches("timeline/hub75/+"):
+            configure_hub75(message.topic.value.rsplit("/", 1)[1], message.payload.decode())
+
+async def publish_metrics(client: aiomqtt.Client) -> None:
+    """Periodically publish frame timing summaries."""
+    while True:
+        await asyncio.sleep(METRICS_INTERVAL)
+        await client.publish("timeline/metrics", json.dumps(metrics.snapshot()))
 
 async def main() -> None:
     """Main entry point."""
     game = TimelineGame()
+    asyncio.get_running_loop().add_signal_handler(
+        signal.SIGUSR1, metrics.dump, METRICS_DUMP_FILE)
     async with aiomqtt.Client(MQTT_SERVER) as subscribe_client:
         await subscribe_client.subscribe("#")
         subscribe_task = asyncio.create_task(
             trigger_events_from_mqtt(subscribe_client, game),
             name="mqtt subscribe handler")
+        metrics_task = asyncio.create_task(
+            publish_metrics(subscribe_client), name="mqtt metrics publisher")
 
         await game.run_game()
         subscribe_task.cancel()
+        metrics_task.cancel()
+        hub75.shutdown()
         pygame.quit()
 
 if __name__ == "__main__":
@@ -0,0 +1,114 @@
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Iterable, Optional, Union
+
+from pyvidplayer2 import Video
+
+from framestore import Playback
+
+DEFAULT_MAX_OPEN: int = 3
+
+Playable = Union[Video, Playback]
+
+class VideoPool:
+    """Open videos keyed by path, opened and rewound on a worker thread.
+
+    Videos are requested ahead of time with prefetch, so that by the time
+    acquire asks for one it has already been opened, seeked to its first
+    frame and paused. Released videos are paused at once and rewound in the
+    background. At most max_open decoders are kept; beyond that the least
+    recently used video, other than the one acquired, is closed.
+    """
+
+    def __init__(self, open_video: Callable[[str], Optional[Playable]], max_open: int = DEFAULT_MAX_OPEN) -> None:
+        self.open_video = open_video
+        self.max_open = max_open
+        self.current: Optional[str] = None
+        self.counters: dict[str, int] = {"hits": 0, "waits": 0, "misses": 0, "opened": 0, "evictions": 0}
+        self._videos: OrderedDict[str, Future] = OrderedDict()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="video pool")
+
+    def _open(self, path: str) -> Optional[Playable]:
+        video = self.open_video(path)
+        if video:
+            self._rewind(video)
+        self.counters["opened"] += 1
+        return video
+
+    @staticmethod
+    def _rewind(video: Playable) -> Playable:
+        # Have the first frame decoded, so it can be drawn as soon as the
+        # video is acquired. Paused first, so that the seek doesn't start
+        # its soundtrack over the one of the video playing now.
+        video.pause()
+        video.seek(0, relative=False)
+        video.buffer_current()
+        return video
+
+    def prefetch(self, paths: Iterable[str]) -> None:
+        """Start opening any of paths that are not open yet."""
+        for path in paths:
+            if path not in self._videos:
+                self._videos[path] = self._executor.submit(self._open, path)
+        self._trim()
+
+    def acquire(self, path: str, wait: bool = True) -> Optional[Playable]:
+        """Make path's video the current one and return it, playing.
+
+        If it is still opening, waits for it, or unless wait returns None;
+        current_video then returns it once it is ready.
+        """
+        future = self._videos.get(path)
+        if future is None:
+            self.counters["misses"] += 1
+        else:
+            self.counters["hits" if future.done() else "waits"] += 1
+        self.current = path
+        self.prefetch([path])
+        self._videos.move_to_end(path)
+        return self.current_video(wait)
+
+    def current_video(self, wait: bool = False) -> Optional[Playable]:
+        """Return the acquired video, playing, or None if it hasn't opened yet."""
+        future = self._videos.get(self.current) if self.current else None
+        if future is None or not (wait or future.done()):
+            return None
+        video = future.result()
+        if video:
+            video.resume()
+        return video
+
+    def release(self, path: str) -> None:
+        """Pause the video for path and rewind it for the next acquire."""
+        if self.current == path:
+            self.current = None
+        future = self._videos.get(path)
+        if future is None or not future.done() or not future.result():
+            return
+        video = future.result()
+        video.pause()
+        self._videos[path] = self._executor.submit(self._rewind, video)
+
+    def _trim(self) -> None:
+        for path in list(self._videos):
+            if len(self._videos) <= self.max_open:
+                break
+            if path != self.current:
+                self._executor.submit(self._close, self._videos.pop(path))
+                self.counters["evictions"] += 1
+
+    @staticmethod
+    def _close(future: Future) -> None:
+        video = future.result()
+        if video:
+            video.close()
+
+    def close(self) -> None:
+        """Close every video and stop the worker thread."""
+        for future in self._videos.values():
+            self._executor.submit(self._close, future)
+        self._videos.clear()
+        self._executor.shutdown(wait=True)
+
+    def stats(self) -> dict[str, int]:
+        return {"open": len(self._videos), "max_open": self.max_open, **self.counters}
@@ -0,0 +1,185 @@
+import logging
+import multiprocessing
+import multiprocessing.connection
+import subprocess
+import time
+from fractions import Fraction
+from typing import Callable, Iterator, Optional, Tuple
+
+import numpy as np
+import pygame
+
+import assets
+import framestore
+import sharedframes
+
+RING_SLOTS: int = 8
+# How long buffer_current waits for the first frame after a seek.
+FIRST_FRAME_TIMEOUT: float = 1.0
+# Frames from the start of a looping video kept in memory, shown while the
+# decoder starts the next pass.
+LOOP_HEAD_FRAMES: int = 30
+
+def run_decoder(commands: multiprocessing.connection.Connection, ring_name: str,
+                size: Tuple[int, int], slots: int) -> None:
+    """Decoder process: decode the stream named by the latest command into the ring.
+
+    Commands are (path, fps, generation, first frame, loop) tuples. Decoding waits
+    while the ring is full, and a new command abandons the current stream at
+    once. A looping stream starts its next pass as soon as one ends, with
+    frame numbers carrying on, and frames the player has cached are decoded
+    but not put. The process exits when the command pipe closes.
+    """
+    ring = sharedframes.SharedFrameRing(size, slots, ring_name)
+    frames: Optional[Iterator[bytes]] = None
+    generation = number = first = 0
+    loop = False
+    try:
+        while True:
+            if frames is None or commands.poll():
+                path, fps, generation, first, loop = commands.recv()
+                if frames:
+                    frames.close()
+                # Seeking to the start of a frame makes it the first decoded.
+                frames = assets.decode_frames(path, size, fps, float(first / fps))
+                number = first
+                continue
+
+            try:
+                frame = next(frames, None)
+            except subprocess.CalledProcessError as error:
+                logging.warning(f"run_decoder: {error}")
+                frame = None
+                loop = False
+            if frame is None:
+                if loop and number > first:
+                    if not ring.length:
+                        ring.length = number
+                    frames = assets.decode_frames(path, size, fps)
+                    first = number
+                else:
+                    ring.end(generation)
+                    frames = None
+                continue
+
+            index = number % ring.length if ring.length else number
+            if index < ring.cached:
+                number += 1
+                continue
+            while ring.full() and not commands.poll(0.005):
+                pass
+            if not ring.full():
+                ring.put(frame, generation, number)
+                number += 1
+    except EOFError:
+        pass
+    finally:
+        if frames:
+            frames.close()
+        ring.close()
+
+class StreamPlayer(framestore.Playback):
+    """Plays a video decoded live by a separate decoder process.
+
+    The decoder writes frames at panel size into a shared memory ring, a few
+    frames ahead of playback, and each draw copies out only the latest frame
+    that is due. Every seek starts a new generation of the stream, so frames
+    still in the ring from before it are discarded.
+
+    A looping player keeps the first head_frames frames in memory once it has
+    seen them. Frame numbers run on across passes, so wrapping around is just
+    the next frame, shown from memory while the decoder starts over.
+    """
+
+    def __init__(self, filepath: str, size: Tuple[int, int], max_fps: int = assets.DEFAULT_MAX_FPS,
+                 slots: int = RING_SLOTS, time_func: Callable[[], float] = time.perf_counter,
+                 loop: bool = False, head_frames: int = LOOP_HEAD_FRAMES) -> None:
+        self.fps = min(assets.probe_fps(filepath), Fraction(max_fps))
+        super().__init__(float(self.fps), time_func, loop)
+        self.filepath = filepath
+        self.ring = sharedframes.SharedFrameRing(size, slots)
+        self.generation = 0
+        self.head_frames = head_frames if loop else 0
+        self._head: list[np.ndarray] = []
+        self._pixels = bytearray(size[0] * size[1] * 3)
+        self._surface = pygame.image.frombuffer(self._pixels, size, "RGB")
+        self._requested = 0.0
+        self._consumed = False
+
+        context = multiprocessing.get_context("spawn")
+        receiver, self._commands = context.Pipe(duplex=False)
+        self._decoder = context.Process(target=run_decoder, name=f"decoder {filepath}", daemon=True,
+                                        args=(receiver, self.ring.name, size, slots))
+        self._decoder.start()
+        receiver.close()
+        self._request(0.0)
+
+    def _request(self, position: float) -> None:
+        self.generation += 1
+        self._commands.send((self.filepath, self.fps, self.generation, int(position * self.frame_rate), self.loop))
+        self._requested = position
+        self._consumed = False
+        self.frame = -1
+
+    def _seek(self, position: float) -> None:
+        # Restarting right after stop would otherwise decode the start twice.
+        if position != self._requested or self._consumed:
+            self._request(position)
+
+    def _pass_frames(self) -> int:
+        return self.ring.length
+
+    def _index(self, number: int) -> int:
+        """Return where frame number falls within a pass of the video."""
+        length = self.ring.length
+        return number % length if length else number
+
+    def _show(self, frame: int) -> bool:
+        """Show the latest frame due by frame, dropping older ones."""
+        latest = None
+        taken = 0
+        for offset in range(len(self.ring)):
+            generation, number, pixels = self.ring.peek(offset)
+            if generation == self.generation:
+                if number > frame:
+                    break
+                if self._index(number) == len(self._head) < self.head_frames:
+                    self._head.append(pixels.copy())
+                    self.ring.cached = len(self._head)
+                latest = number, pixels
+            taken = offset + 1
+        index = self._index(frame)
+        if index < len(self._head):
+            latest = frame, self._head[index]
+        changed = latest is not None and latest[0] > self.frame
+        if changed:
+            self.frame, pixels = latest
+            np.copyto(np.frombuffer(self._pixels, np.uint8), pixels.reshape(-1))
+            self.frame_surf = self._surface
+            self._consumed = True
+        self.ring.take(taken)
+        return changed
+
+    def buffer_current(self) -> bool:
+        """Wait for the first frame after a seek, up to FIRST_FRAME_TIMEOUT."""
+        deadline = time.perf_counter() + FIRST_FRAME_TIMEOUT
+        while time.perf_counter() < deadline:
+            if self._show(int(self.get_pos() * self.frame_rate)):
+                return True
+            time.sleep(0.002)
+        return False
+
+    def update(self) -> bool:
+        changed = self._show(self._due_frame())
+        if not changed and self._consumed and not len(self.ring) and self.ring.ended(self.generation):
+            self.stop()
+        return changed
+
+    def close(self) -> None:
+        super().close()
+        # The decoder exits when its command pipe closes.
+        self._commands.close()
+        self._decoder.join(1)
+        if self._decoder.is_alive():
+            self._decoder.terminate()
+        self.ring.close()